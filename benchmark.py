@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmarks
+(part of ExifViewer project - https://github.com/PicciMario/EXIF-Viewer)
+Copyright (c) 2011 PicciMario <mario.piccinelli@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import sys, os, time, struct, subprocess, tempfile, shutil
+
+# runs function(*args) repeat times, returns the best time (seconds)
+def bestOf(repeat, function, *args):
+	best = None
+	for i in range(repeat):
+		start = time.time()
+		function(*args)
+		elapsed = time.time() - start
+		if (best == None or elapsed < best):
+			best = elapsed
+	return best
+
+# prints the time of function on inputs of growing size; with a linear
+# algorithm the time per item stays about the same on each row
+def scaling(name, function, makeInput, sizes, repeat=3):
+	print("%s:"%name)
+	for size in sizes:
+		data = makeInput(size)
+		elapsed = bestOf(repeat, function, data)
+		print("  %10i items  %9.3f ms  %8.1f ns/item"%(size, elapsed * 1000, elapsed * 1e9 / size))
+
+# a small JPEG file with EXIF tags (IFD0, Exif and GPS), saved as path
+def makeJpeg(path, width=64, height=48):
+	from PIL import Image
+
+	# little endian TIFF, the IFDs follow each other; each entry is
+	# [tag, type, count, value (number, or data)]
+	def ifd(offset, entries, nextIfd=0):
+		data = ""
+		extra = ""
+		extraOffset = offset + 2 + len(entries) * 12 + 4
+		out = struct.pack("<H", len(entries))
+		for (tag, type, count, value) in entries:
+			if (isinstance(value, str)):
+				if (len(value) <= 4):
+					out += struct.pack("<HHI", tag, type, count) + value.ljust(4, "\0")
+				else:
+					out += struct.pack("<HHII", tag, type, count, extraOffset + len(extra))
+					extra += value
+			else:
+				out += struct.pack("<HHII", tag, type, count, value)
+		return out + struct.pack("<I", nextIfd) + extra
+
+	def rationals(*values):
+		return "".join([struct.pack("<II", n, d) for (n, d) in values])
+
+	ifd0Entries = 5
+	ifd0Size = 2 + ifd0Entries * 12 + 4 + len("Canon\0") + len("EOS 5D\0")
+	exifOffset = 8 + ifd0Size
+	exifEntries = [
+		[34850, 3, 1, 2],
+		[36867, 2, 20, "2011:10:08 12:00:00\0"],
+		[37385, 3, 1, 16],
+	]
+	exifSize = len(ifd(exifOffset, exifEntries))
+	gpsOffset = exifOffset + exifSize
+	gpsEntries = [
+		[1, 2, 2, "N\0"],
+		[2, 5, 3, rationals((45, 1), (32, 1), (1234, 100))],
+		[3, 2, 2, "E\0"],
+		[4, 5, 3, rationals((10, 1), (13, 1), (5678, 100))],
+	]
+	ifd0 = [
+		[271, 2, 6, "Canon\0"],
+		[272, 2, 7, "EOS 5D\0"],
+		[274, 3, 1, 1],
+		[34665, 4, 1, exifOffset],
+		[34853, 4, 1, gpsOffset],
+	]
+	tiff = "II*\0" + struct.pack("<I", 8) + ifd(8, ifd0) + ifd(exifOffset, exifEntries) + ifd(gpsOffset, gpsEntries)
+
+	Image.new("RGB", (width, height), (128, 64, 32)).save(path, "JPEG", exif="Exif\0\0" + tiff)
+
+# runs a command in a new interpreter repeat times, returns the best time
+# (seconds)
+def bestRun(repeat, args):
+	devnull = open(os.devnull, "w")
+	def run():
+		subprocess.call([sys.executable] + args, stdout=devnull, stderr=devnull)
+	best = bestOf(repeat, run)
+	devnull.close()
+	return best
+
+# ------- Benchmarks ------------------------------------------------------
+
+def benchWrapString():
+	from exif2reporter import wrapString
+
+	# a long XMP-like value: long runs of non-space characters, and some
+	# shorter words
+	def makeInput(size):
+		chunk = "0123456789ABCDEF" * 10 + " short words here "
+		return (chunk * (size / len(chunk) + 1))[:size]
+
+	scaling("wrapString (80 chars)", lambda data: wrapString(data, numChars=80), makeInput, [1000, 10000, 100000, 1000000])
+
+# exiv2 tags spread over many groups, as in XMP-heavy files, with some
+# long values
+def makeExifs(size):
+	exifs = []
+	for i in range(size):
+		value = "value %i"%i
+		if (i % 10 == 0):
+			value = "0123456789ABCDEF" * 20
+		exifs.append({
+			"tag": i % 500,
+			"key": "Xmp.group%i.Tag%i"%(i % 50, i),
+			"key1": ["Exif", "Iptc", "Xmp"][i % 3],
+			"key2": "group%i"%(i % 50),
+			"key3": "Tag%i"%i,
+			"varType": "XmpText",
+			"varNumber": len(value),
+			"descr": value,
+			"raw": value
+		})
+	return exifs
+
+def benchExifSection():
+	import exif2reporter
+	exif2reporter.loadReportLab()
+
+	scaling("exifSection (story build)", lambda exifs: exif2reporter.exifSection("", exifs, None), makeExifs, [500, 2000, 8000])
+
+# the same tags as benchExifSection, laid out in a PDF (in memory) with
+# the compact and the per-tag tables; budget is the time allowed to lay
+# out 2000 tags with the compact tables
+def benchLayout(budget=1.0):
+	import exif2reporter, cStringIO
+	exif2reporter.loadReportLab()
+	from reportlab.platypus import SimpleDocTemplate
+	from reportlab.lib.pagesizes import letter
+
+	def layout(exifs, compact=True):
+		doc = SimpleDocTemplate(cStringIO.StringIO(), pagesize=letter,
+		                        rightMargin=40,leftMargin=40,
+		                        topMargin=40,bottomMargin=40)
+		doc.build(exif2reporter.exifSection("", exifs, None, compactExif=compact))
+
+	for compact in [True, False]:
+		name = "EXIF section layout (%s)"%["per-tag tables", "compact tables"][compact]
+		scaling(name, lambda exifs: layout(exifs, compact), makeExifs, [500, 2000], repeat=1)
+
+	elapsed = bestOf(1, layout, makeExifs(2000))
+	if (elapsed > budget):
+		print("  over budget: 2000 tags in %.3fs, budget %.3fs"%(elapsed, budget))
+	else:
+		print("  within budget: 2000 tags in %.3fs, budget %.3fs"%(elapsed, budget))
+
+# hex dump of large binary values (MakerNote, UserComment), with the
+# default limit and without limit
+def benchHexDump():
+	import exifviewer
+	exifData = exifviewer.ExifData()
+
+	def makeInput(size):
+		return memoryview("".join([chr(i % 256) for i in range(size)]))
+
+	scaling("dumpHex (16 bytes per row, default limit)", lambda data: exifData.dumpHex(data, length=16), makeInput, [1 << 10, 1 << 20, 1 << 23])
+	scaling("dumpHex (16 bytes per row, no limit)", lambda data: exifData.dumpHex(data, length=16, limit=sys.maxint), makeInput, [1 << 10, 1 << 20, 1 << 23], repeat=1)
+	scaling("stringHex", lambda data: exifData.stringHex(data), makeInput, [1 << 10, 1 << 20, 1 << 23])
+
+# EXIF extraction from a large JPEG: the native header parser against
+# PIL (Image.open and _getexif)
+def benchExifParse(repeat=20):
+	import exifviewer
+	from PIL import Image
+
+	tempDir = tempfile.mkdtemp(prefix="benchmark-")
+	try:
+		jpeg = os.path.join(tempDir, "large.jpg")
+		makeJpeg(jpeg, 6000, 4000)
+
+		def native():
+			(tiff, width, height, components) = exifviewer.readJpegHeader(jpeg)
+			exifviewer.parseExif(tiff)
+
+		def pil():
+			Image.open(jpeg)._getexif()
+
+		print("EXIF extraction (6000x4000 JPEG, %i kB):"%(os.path.getsize(jpeg) / 1024))
+		print("  %-36s %9.3f ms"%("native header parser", bestOf(repeat, native) * 1000))
+		print("  %-36s %9.3f ms"%("PIL open + _getexif", bestOf(repeat, pil) * 1000))
+	finally:
+		shutil.rmtree(tempDir, ignore_errors=True)
+
+# tag interpretation (exifToArray on every tag, as done by printExifs and
+# by reading all of getExifs) of a small JPEG, and of three tags only
+def benchInterpret(repeat=200):
+	import exifviewer
+
+	tempDir = tempfile.mkdtemp(prefix="benchmark-")
+	try:
+		jpeg = os.path.join(tempDir, "sample.jpg")
+		makeJpeg(jpeg)
+		exifData = exifviewer.ExifData()
+		exifData.openFile(jpeg)
+
+		print("Tag interpretation (%i tags):"%len(exifData.exifs))
+		print("  %-36s %9.3f ms"%("getExifs, all tags read", bestOf(repeat, lambda: list(exifData.getExifs())) * 1000))
+		print("  %-36s %9.3f ms"%("getExifs, 3 tags read", bestOf(repeat, lambda: list(exifData.getExifs(tags=[271, 272, 274]))) * 1000))
+	finally:
+		shutil.rmtree(tempDir, ignore_errors=True)
+
+# repeat scan of many files with exifviewer: parsed each time, first run
+# with the metadata cache (parse and save), warm runs (cache only), and
+# os.stat alone for reference
+def benchMetaCache(files=1000):
+	import exifviewer, metacache
+
+	tempDir = tempfile.mkdtemp(prefix="benchmark-")
+	try:
+		first = os.path.join(tempDir, "image0.jpg")
+		makeJpeg(first)
+		data = open(first, "rb").read()
+		paths = [first]
+		for i in range(1, files):
+			paths.append(os.path.join(tempDir, "image%i.jpg"%i))
+			f = open(paths[-1], "wb")
+			f.write(data)
+			f.close()
+
+		exifData = exifviewer.ExifData()
+		def scan():
+			for path in paths:
+				exifData.openFile(path)
+
+		def stat():
+			for path in paths:
+				os.stat(path)
+
+		print("Metadata cache (%i files):"%files)
+		print("  %-36s %9.3f ms"%("os.stat only", bestOf(3, stat) * 1000))
+		print("  %-36s %9.3f ms"%("no cache", bestOf(3, scan) * 1000))
+
+		exifviewer.metaCache = metacache.MetaCache(os.path.join(tempDir, "cache.db"))
+		try:
+			print("  %-36s %9.3f ms"%("cold cache", bestOf(1, scan) * 1000))
+			print("  %-36s %9.3f ms"%("warm cache", bestOf(3, scan) * 1000))
+		finally:
+			exifviewer.metaCache.close()
+			exifviewer.metaCache = None
+	finally:
+		shutil.rmtree(tempDir, ignore_errors=True)
+
+# True if a process of group pgid is running (zombies, waiting for the
+# init process to collect them, do not count)
+def groupAlive(pgid):
+	if (os.path.isdir("/proc/self") == False):
+		try:
+			os.killpg(pgid, 0)
+			return True
+		except OSError:
+			return False
+	for pid in os.listdir("/proc"):
+		if (pid.isdigit() == False):
+			continue
+		try:
+			f = open("/proc/%s/stat"%pid)
+			stat = f.read()
+			f.close()
+		except IOError:
+			continue
+		# pid (comm) state ppid pgrp ...
+		fields = stat[stat.rindex(")") + 2:].split()
+		if (fields[0] != "Z" and int(fields[2]) == pgid):
+			return True
+	return False
+
+# exifviewer.py on many files piped into "head -1": the program, and its
+# worker processes, must end soon after head closes the pipe; timeout is
+# the time allowed (seconds)
+def benchClosedPipe(files=2000, timeout=10.0):
+
+	here = os.path.dirname(os.path.abspath(__file__))
+	tempDir = tempfile.mkdtemp(prefix="benchmark-")
+	try:
+		first = os.path.join(tempDir, "image0.jpg")
+		makeJpeg(first)
+		for i in range(1, files):
+			os.symlink(first, os.path.join(tempDir, "image%i.jpg"%i))
+
+		print("Closed pipe (%i files | head -1):"%files)
+		for format in ["text", "jsonl"]:
+			devnull = open(os.devnull, "w")
+			# own process group, to find the workers left behind
+			viewer = subprocess.Popen([sys.executable, os.path.join(here, "exifviewer.py"), "-j", "4", "-f", format, tempDir],
+			                          stdout=subprocess.PIPE, stderr=devnull, preexec_fn=os.setsid)
+			head = subprocess.Popen(["head", "-1"], stdin=viewer.stdout, stdout=devnull)
+			viewer.stdout.close()
+
+			start = time.time()
+			while (viewer.poll() == None and time.time() - start < timeout):
+				time.sleep(0.05)
+			elapsed = time.time() - start
+			head.wait()
+			devnull.close()
+
+			# anything left in the group (the program or its workers,
+			# given a moment to exit)
+			deadline = time.time() + 1.0
+			while (groupAlive(viewer.pid) and time.time() < deadline):
+				time.sleep(0.05)
+			left = groupAlive(viewer.pid)
+			if (left):
+				os.killpg(viewer.pid, 9)
+
+			if (viewer.returncode == None or left):
+				print("  %-36s FAILED: still running after %.1fs"%(format, timeout))
+			else:
+				print("  %-36s %9.3f ms (exit status %i)"%(format, elapsed * 1000, viewer.returncode))
+	finally:
+		shutil.rmtree(tempDir, ignore_errors=True)
+
+# startup costs: interpreter start, import time of the heavier modules
+# (measured in a new interpreter each, python 2 has no -X importtime),
+# and the command line tools; budget is the time allowed to
+# "exifviewer.py file.jpg", interpreter start included
+def benchStartup(budget=0.05, repeat=5):
+
+	here = os.path.dirname(os.path.abspath(__file__))
+	tempDir = tempfile.mkdtemp(prefix="benchmark-")
+	try:
+		jpeg = os.path.join(tempDir, "sample.jpg")
+		makeJpeg(jpeg)
+
+		print("Startup:")
+		base = bestRun(repeat, ["-c", "pass"])
+		print("  %-36s %9.3f ms"%("interpreter", base * 1000))
+
+		modules = ["logging", "PIL.Image", "PIL.ExifTags", "urllib2", "xml.dom.minidom", "multiprocessing", "reportlab.platypus", "exifviewer", "exif2reporter"]
+		for module in modules:
+			elapsed = bestRun(repeat, ["-c", "import sys; sys.path.insert(0, %r); import %s"%(here, module)])
+			print("  %-36s %9.3f ms"%("import %s"%module, (elapsed - base) * 1000))
+
+		commands = [
+			["exifviewer.py sample.jpg", [os.path.join(here, "exifviewer.py"), jpeg]],
+			["exif2reporter.py -h", [os.path.join(here, "exif2reporter.py"), "-h"]],
+		]
+		for (name, args) in commands:
+			elapsed = bestRun(repeat, args)
+			print("  %-36s %9.3f ms"%(name, elapsed * 1000))
+			if (name.startswith("exifviewer.py")):
+				viewerTime = elapsed
+
+		if (viewerTime > budget):
+			print("  over budget: exifviewer.py in %.3fs, budget %.3fs"%(viewerTime, budget))
+		else:
+			print("  within budget: exifviewer.py in %.3fs, budget %.3fs"%(viewerTime, budget))
+	finally:
+		shutil.rmtree(tempDir, ignore_errors=True)
+
+benchmarks = [
+	['wrapstring', benchWrapString],
+	['exifsection', benchExifSection],
+	['layout', benchLayout],
+	['startup', benchStartup],
+	['exifparse', benchExifParse],
+	['hexdump', benchHexDump],
+	['interpret', benchInterpret],
+	['metacache', benchMetaCache],
+	['closedpipe', benchClosedPipe],
+]
+
+if __name__ == "__main__":
+
+	names = sys.argv[1:]
+	if (len(names) == 0):
+		names = [benchmark[0] for benchmark in benchmarks]
+
+	for name in names:
+		found = [benchmark for benchmark in benchmarks if benchmark[0] == name]
+		if (len(found) == 0):
+			print("Unknown benchmark \"%s\". Available: %s"%(name, ", ".join([benchmark[0] for benchmark in benchmarks])))
+			sys.exit(1)
+		found[0][1]()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 """
-EXIF reporter 
+EXIF reporter
 (part of ExifViewer project - https://github.com/PicciMario/EXIF-Viewer)
 Copyright (c) 2011 PicciMario <mario.piccinelli@gmail.com>
 
@@ -13,33 +13,23 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 """
 
 # Various dependencies
-import sys, math, os, hashlib, time, urllib, getopt, subprocess, string
-
-# Exif Data Class
-# from the ExifViewer project too
-from exifviewer import ExifData
-
-# XML manager
-# to manage data read from reverse geocoding
-from xml.dom import minidom
-
-# Python Imaging Library
-# needed to handle images
-import PIL, cStringIO
-from PIL import ImageDraw
-from PIL import Image as PILImage
-
-# ReportLab project dependencies
-from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Preformatted, Spacer, Image, PageBreak, Table, TableStyle, NextPageTemplate
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-
-# socket default timeout
-import socket
-socket.setdefaulttimeout(10)
+import sys, math, os, hashlib, time, getopt, subprocess, string, glob, re
+
+# Per-report private workspace
+import tempfile, shutil
+
+# In-memory images
+import cStringIO
+
+# The heavier dependencies are imported where they are used, so that the
+# tool starts quickly and the module can be imported (e.g. for readExifs)
+# without them:
+#  - ReportLab (PDF) and the styles: loadReportLab(), called by Reporter
+#  - PIL (images): header, previews and map sections
+#  - urllib2 and minidom (maps and reverse geocoding): map section
+#  - threading (concurrent map downloads): runConcurrently()
+#  - multiprocessing (batch mode): runBatch()
+#  - tilecache and geocoder (tiles cache, offline geocoding): main()
 
 # sections switch (for debug purposes)
 printHeader 	= True
@@ -48,30 +38,66 @@ printPreviews 	= True
 printMap 		= True
 printExif		= True
 
+# map tiles cache (a tilecache.TileCache, see --tile-cache), given to the
+# Reporter of the command line
+tileCache = None
+
+# offline mode: no network access, maps only from the tiles cache (given
+# to the Reporter of the command line)
+offline = False
+
+# local reverse geocoder (a geocoder.LocalGeocoder, see --geocoder), used
+# in place of the online Nominatim service
+localGeocoder = None
+
+# reverse geocoding results, by coordinates rounded to
+# geocodeCachePrecision decimals (4 decimals: about 10 m)
+geocodeCache = {}
+geocodeCachePrecision = 4
+geocodeCacheMaxSize = 10000
+
+# timeout (seconds) of each network request (map tiles, reverse geocoding)
+networkTimeout = 10
+
+# overall time (seconds) the map section waits for the three map tiles
+# and the reverse geocoding, which are fetched concurrently
+mapTimeout = 15
+
+# EXIF section rendering: one splittable table per group of tags (True)
+# or a separate table for each tag (False, see --per-tag-tables); given
+# to the Reporter of the command line
+compactExif = True
+
+# expected time (seconds) for the layout of the PDF (doc.build), a warning
+# is printed when it is exceeded (None: no check, see --layout-budget)
+layoutBudget = None
+
+# metadata cache (a metacache.MetaCache, see --meta-cache): the exiv2
+# tags of the files not changed since the last run are not read again
+metaCache = None
+
+# kind of the entries of readExifs() in the metadata cache; to be changed
+# when the records of extractExifs() change, so old entries are not used
+metaCacheKind = "exif2reporter-2"
+
+# extensions picked up when scanning a directory in batch mode
+batchExtensions = ['.jpg', '.jpeg', '.jpe', '.tif', '.tiff']
+
+# raised by Reporter (and generateReport()) when a report can not be built
+class ReportError(Exception):
+	pass
+
+# compiled wrapString patterns, by numChars
+wrapPatterns = {}
+
 # insert a space in a string after each numChars non-space characters
+# (only if other non-space characters follow), in a single pass
 def wrapString(string, numChars=80):
-	completed = False
-	while (completed != True):
-	
-		consecutive = 0
-		posInString = 0
-		
-		for c in string:
-			posInString += 1
-			if (c not in [' ', '\n']):
-				consecutive += 1
-				if (consecutive >= numChars):
-					consecutive = 0
-					string = string[0:posInString] + " " + string[posInString:-1]
-					print(posInString)
-					continue
-					#return string
-			else:
-				consecutive = 0
-			
-		completed = True
-	
-	return string
+	pattern = wrapPatterns.get(numChars)
+	if (pattern == None):
+		pattern = re.compile("([^ \n]{%i})(?=[^ \n])"%numChars)
+		wrapPatterns[numChars] = pattern
+	return pattern.sub("\\1 ", string)
 
 def usage():
 	print("")
@@ -88,303 +114,486 @@ def usage():
 	print("exifreporter.py -f filename -o reportname")
 	print("")
 	print("If a report name is not provided, the tool will use the default: report.pdf.")
+	print("")
+	print("Batch mode (one report per image):")
+	print("exifreporter.py [-f file|glob ...] [-d directory] [-l listfile] -O outdir [-j workers]")
+	print("")
+	print(" -f   input file or glob pattern (can be repeated); an existing file")
+	print("      is never expanded as a pattern. -o is not used in batch mode")
+	print(" -d   directory to scan recursively for images")
+	print(" -l   file with one input file name per line (\"-\" for stdin)")
+	print(" -O   output directory for the reports (default: reports)")
+	print(" -j   number of worker processes (default: number of CPUs)")
+	print("")
+	print("Other options:")
+	print(" -t   parent directory for the temporary workspace of each report")
+	print("      (default: the system temp dir, the workspace is removed afterwards)")
+	print(" --tile-cache=dir       keep the downloaded map tiles in dir")
+	print(" --tile-cache-size=MB   max size of the tiles cache (default: 200)")
+	print(" --tile-seed=source     tiles dir (zoom/x/y.png) or MBTiles file looked up")
+	print("                        before downloading a tile (can be repeated)")
+	print(" --offline              never use the network: maps only from the cache")
+	print("                        and seed sources, no reverse geocoding")
+	print(" --geocoder=index       offline reverse geocoding index (see geocoder.py),")
+	print("                        used in place of OpenStreetMap Nominatim")
+	print(" --meta-cache=file      metadata cache (SQLite file, created if missing): the")
+	print("                        tags of the files not changed (size, mtime, inode)")
+	print("                        since the last run are not read again by exiv2")
+	print(" --per-tag-tables       EXIF tags in a separate table each (slower layout)")
+	print(" --layout-budget=sec    warn when the PDF layout takes longer than this")
+	print(" --map-timeout=seconds  overall time to wait for the maps and the reverse")
+	print("                        geocoding, fetched concurrently (default: 15)")
 
-filename = ""
-reportFileName = ""
+# ------- EXIV2 Tags ----------------------------------------------------
 
-try:
-	opts, args = getopt.getopt(sys.argv[1:], "hf:o:")
-except getopt.GetoptError:
-	usage()
-	sys.exit(0)
+def runExiv2(command):
+	try:
+		return subprocess.Popen(command, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	except:
+		print("\nUnable to run EXIF2. Is it installed and available?")
+		print("If not, you have to download it from http://www.exiv2.org/\n")
+		raise ReportError("Unable to run exiv2")
 
-for o,a in opts:
-	if o == "-h":
-		usage()
-		sys.exit(0)
-	elif o == "-f":
-		filename = a
-	elif o == "-o":
-		reportFileName = a
-
-if (len(filename) == 0):
-	usage()
-	print("You need to provide a in input file name.\n")
-	sys.exit(1)
-
-if (len(reportFileName) == 0):
-	defaultReportFileName = "report.pdf"
-	print("Didn't provide an output file name. Using default: %s"%defaultReportFileName)
-	reportFileName = defaultReportFileName
-
-# check file existence
-if (os.path.isfile(filename) == 0):
-	usage()
-	print("Provided input file does not exist.\n")
-	sys.exit(1)	
-
-# check existence of temp dirs (or create)
-tempDirs = ['tmp', 'tmp/prw']
-
-for tempDir in tempDirs:
-	if (os.path.isdir(tempDir)):
-		continue
-	else:
+# indexes a list of records (dictionaries) by one of their fields:
+# value -> list of records, in their original order (keys can repeat,
+# as with XMP bags or IPTC repeatable datasets)
+def indexRecords(records, field='key'):
+	index = {}
+	for record in records:
+		index.setdefault(record[field], []).append(record)
+	return index
+
+# runs exiv2 and returns its whole output as a list of lines
+def readExiv2(command):
+	p = runExiv2(command)
+	output = p.communicate()[0]
+	return output.splitlines()
+
+# for each record, the number of records before it with the same key:
+# exiv2 prints repeated keys in the same order in every pass, so the n-th
+# occurrence of a key in a pass matches the n-th in another
+def keyOccurrences(records):
+	occurrences = {}
+	ret = []
+	for record in records:
+		n = occurrences.get(record['key'], 0)
+		occurrences[record['key']] = n + 1
+		ret.append(n)
+	return ret
+
+# "key value" lines printed by exiv2 -Pkv or -Pkt, as records with the
+# value in field
+def readKeyValues(command, field):
+	records = []
+	for o in readExiv2(command):
 		try:
-			os.makedirs(tempDir)
+			(key, value) = string.split(o, None, 1)
 		except:
-			print("Unable to create temp dir: \"%s\". Check permissions."%tempDir)
-			sys.exit(1)
+			key = o
+			value = ""
+		records.append({"key": key, field: value})
+	return records
 
-# clear content of temp dirs
-for tempDir in tempDirs:
-	for file in os.listdir(tempDir):
-		try:
-			if os.path.isfile(os.path.join(tempDir, file)):
-				os.unlink(os.path.join(tempDir, file))
-		except Exception, e:
-			print e
-
-
-# launch EXIV2 to aquire tags
-print("Lauch EXIV2 to acquire tags...")
-command = [
-	"exiv2",
-	"-q",
-	#"-u",
-	"-Pxkyct",
-	filename
+# exiv2 types whose value is printed as a list of varNumber numbers
+numericTypes = [
+	'Byte', 'Short', 'Long', 'Rational', 'SByte', 'Undefined', 'SShort', 'SLong',
+	'SRational', 'Float', 'Double', 'Ifd', 'Long8', 'SLong8', 'Ifd8'
 ]
-try:
-	p = subprocess.Popen(command, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-except:
-	print("\nUnable to run EXIF2. Is it installed and available?")
-	print("If not, you have to download it from http://www.exiv2.org/\n")
-	sys.exit(1)
-
-# save output in exifs array
-exifs = []
-while True:
-	o = p.stdout.readline()
-	if o == '' and p.poll() != None: break
-	
-	try:
-		(tag, key, varType, varNumber, descr) = string.split(o.strip("\n"), None, 4)
-	except:
+
+# printed length of the value of text types, given varNumber
+textLengths = {
+	'Ascii': lambda count: count - 1,
+	'String': lambda count: count,
+	'XmpText': lambda count: count,
+}
+
+# value printed by exiv2 in place of big binary tags (no translation
+# follows, it is read with a separate pass)
+binarySuppressed = "(Binary value suppressed)"
+
+# separates "value translation" as printed by exiv2 -Pvt when value and
+# translation are the same string, returns None otherwise
+def splitEqualHalves(data):
+	for sepLen in [1, 2]:
+		if ((len(data) - sepLen) % 2 != 0): continue
+		half = (len(data) - sepLen) / 2
+		if (data[half:half+sepLen] == " " * sepLen and data[:half] == data[half+sepLen:]):
+			return data[:half]
+	return None
+
+# separates the raw value and the translated description in the "rest" of
+# a line printed by exiv2 -Pxkycvt; returns (raw, descr) or None when the
+# boundary can not be determined from the type and count of the tag
+def splitValue(data, varType, varNumber):
+
+	if (varNumber == 0):
+		return ("", data.lstrip(" "))
+
+	# numbers: the value is made of exactly varNumber tokens
+	if (varType in numericTypes):
+		parts = data.split(" ", varNumber)
+		numbers = parts[:varNumber]
+		if (len(numbers) == varNumber and "" not in numbers and "".join(numbers).strip("0123456789/-+.e") == ""):
+			if (len(parts) == varNumber):
+				return (data, "")
+			return (" ".join(numbers), parts[varNumber].lstrip(" "))
+
+	# comments: "charset=Xxx " prefix, then text and its translation
+	if (data.startswith("charset=") and " " in data):
+		prefix = data[:data.index(" ") + 1]
+		text = splitEqualHalves(data[len(prefix):])
+		if (text != None):
+			return (prefix + text, text)
+
+	# strings: usually the translation is the same as the value
+	text = splitEqualHalves(data)
+	if (text != None):
+		return (text, text)
+
+	if (varType in textLengths):
+		length = textLengths[varType](varNumber)
+		if (length >= 0 and data[length:length+1] == " "):
+			return (data[:length], data[length:].lstrip(" "))
+
+	return None
+
+# the exiv2 tags of filename; from the metadata cache (see --meta-cache)
+# if the file did not change since they were saved there. cache=False
+# for the files that are not worth caching (temporary copies)
+def readExifs(filename, cache=True):
+
+	if (metaCache == None or cache == False):
+		return extractExifs(filename)
+
+	(key, exifs) = metaCache.lookup(metaCacheKind, filename)
+	if (exifs != None):
+		print("EXIF tags from the metadata cache")
+		return exifs
+
+	exifs = extractExifs(filename)
+	# nothing read: exiv2 missing or failing, try again next time
+	if (len(exifs) > 0):
+		metaCache.store(metaCacheKind, key, exifs)
+	return exifs
+
+def extractExifs(filename):
+
+	# launch EXIV2 to aquire tags, raw values and their translation
+	# in a single pass
+	print("Lauch EXIV2 to acquire tags...")
+	command = [
+		"exiv2",
+		"-q",
+		#"-u",
+		"-Pxkycvt",
+		filename
+	]
+
+	# save output in exifs array
+	exifs = []
+	suppressed = []
+	for o in readExiv2(command):
+
+		try:
+			(tag, key, varType, varNumber, data) = string.split(o, None, 4)
+		except:
+			try:
+				(tag, key, varType, varNumber) = string.split(o, None, 3)
+				data = ""
+			except:
+				print("Unable to decode key: \"%s\""%o)
+				continue
+
 		try:
-			(tag, key, varType, varNumber) = string.split(o.strip("\n"), None, 3)
-			descr = ""
+			key1, key2, key3 = string.split(key, ".")
 		except:
 			print("Unable to decode key: \"%s\""%key)
-			continue	
-	
-	try:
-		key1, key2, key3 = string.split(key, ".")
-	except:
-		print("Unable to decode key: \"%s\""%key)
-		continue
+			continue
 
-	try:
-		exif = {
-			"tag": int(tag, 16),
-			"key": key,
-			"key1": key1,
-			"key2": key2,
-			"key3": key3,
-			"varType": varType,
-			"varNumber": int(varNumber),
-			"descr": descr
-		}
-	except:
-		print("Unable to decode key: \"%s\""%key)
-		continue	
-	
-	exifs.append(exif)
-	
-retval = p.wait()
-
-# launch EXIV2 to aquire raw values
-print("Lauch EXIV2 to aquire raw values...")
-command = [
-	"exiv2",
-	"-q",
-	#"-u",
-	"-Pkv",
-	filename
-]
-try:
-	p = subprocess.Popen(command, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-except:
-	print("\nUnable to run EXIF2. Is it installed and available?")
-	print("If not, you have to download it from http://www.exiv2.org/\n")
-	sys.exit(1)
-
-# save output in exifs array
-exifRaws = []
-while True:
-	o = p.stdout.readline()
-	if o == '' and p.poll() != None: break
+		try:
+			exif = {
+				"tag": int(tag, 16),
+				"key": key,
+				"key1": key1,
+				"key2": key2,
+				"key3": key3,
+				"varType": varType,
+				"varNumber": int(varNumber)
+			}
+		except:
+			print("Unable to decode key: \"%s\""%key)
+			continue
 
-	try:
-		(key, raw) = string.split(o.strip("\n"), None, 1)
-	except:
-		key = o.strip("\n")
-		raw = ""
-	
-	try:
-		exifRaw = {
-			"raw": raw,
-			"key": key
-		}
-		exifRaws.append(exifRaw)
-	except:
-		print("Unable to decode raw key: \"%s\""%key)
-		continue	
-	
-retval = p.wait()
-
-# merge two dictionaries
-print("Merging values...")
-for exif in exifs:
-	for exifRaw in exifRaws:
-		if (exifRaw['key'] == exif['key']):
-			exif['raw'] = exifRaw['raw']
-			break
+		if (data == binarySuppressed):
+			# translation read below with a separate pass
+			exif['raw'] = data
+			exif['descr'] = data
+			suppressed.append(exif)
+		else:
+			values = splitValue(data, exif['varType'], exif['varNumber'])
+			if (values != None):
+				exif['raw'], exif['descr'] = values
+			else:
+				# resolved below with a separate raw values pass
+				exif['descr'] = data
+
+		exifs.append(exif)
+
+	# big binary values (UserComment, XP comments...) are suppressed by
+	# -Pv, but their translation is often readable: launch EXIV2 again
+	# for the translation of those keys only
+	if (len(suppressed) > 0):
+		print("Lauch EXIV2 to aquire translations of binary values...")
+		keys = []
+		for exif in suppressed:
+			if (exif['key'] not in keys):
+				keys.append(exif['key'])
+		command = ["exiv2", "-q", "-Pkt"]
+		for key in keys:
+			command.extend(["-K", key])
+		command.append(filename)
+
+		descrIndex = indexRecords(readKeyValues(command, "descr"))
+		for (exif, n) in zip(exifs, keyOccurrences(exifs)):
+			if (exif in suppressed):
+				descrs = descrIndex.get(exif['key'], [])
+				if (n < len(descrs)):
+					exif['descr'] = descrs[n]['descr']
 
-for exif in exifs:
-	if ('raw' in exif.keys()):
-		continue
-	else:
-		exif['raw'] = ""
+	unresolved = [exif for exif in exifs if ('raw' not in exif.keys())]
+	if (len(unresolved) == 0):
+		return exifs
+
+	# some values can't be told apart from their translation: launch
+	# EXIV2 again to aquire raw values only
+	print("Lauch EXIV2 to aquire raw values...")
+	command = [
+		"exiv2",
+		"-q",
+		#"-u",
+		"-Pkv",
+		filename
+	]
+
+	# save output in exifs array
+	exifRaws = readKeyValues(command, "raw")
+
+	# merge two dictionaries
+	# both passes list the tags in the same order, so the n-th occurrence
+	# of a key in exifs gets the n-th raw value printed for that key
+	print("Merging values...")
+	rawIndex = indexRecords(exifRaws)
+	for (exif, n) in zip(exifs, keyOccurrences(exifs)):
+		if ('raw' in exif.keys()):
+			continue
+		raws = rawIndex.get(exif['key'], [])
+		if (n < len(raws)):
+			exif['raw'] = raws[n]['raw']
+
+	for exif in unresolved:
+		if ('raw' in exif.keys()):
+			# value and translation are separated by one or two spaces
+			if (exif['descr'].startswith(exif['raw'])):
+				exif['descr'] = exif['descr'][len(exif['raw']):].lstrip(" ")
+		else:
+			exif['raw'] = ""
+
+	return exifs
 
 # ------- PDF Styles ----------------------------------------------------
 
-styles=getSampleStyleSheet()
-styles.add(ParagraphStyle(name='Justify', alignment=TA_JUSTIFY))
-
-styles.add(
-	ParagraphStyle(
-		name='CodeNoIndent',
-		fontName='Courier',
-		fontSize=8,
-		leading=12,
-		firstLineIndent=0,
-		leftIndent=0,
-		spaceBefore=6
+# ReportLab names used by the sections, and the styles; set by
+# loadReportLab()
+styles = None
+
+def loadReportLab():
+
+	global TA_JUSTIFY, TA_CENTER, letter, colors, inch, stringWidth, simpleSplit
+	global SimpleDocTemplate, Paragraph, Preformatted, Spacer, Image, PageBreak, Table, TableStyle, NextPageTemplate
+	global LayoutError, getSampleStyleSheet, ParagraphStyle
+	global styles, tableStyleStandard, tableStyleSmall, tableStyleExif, tableStyle4col, tableStyleImg, tableStyleGray
+
+	if (styles != None):
+		return
+
+	from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
+	from reportlab.lib.pagesizes import letter
+	from reportlab.lib import colors
+	from reportlab.platypus import SimpleDocTemplate, Paragraph, Preformatted, Spacer, Image, PageBreak, Table, TableStyle, NextPageTemplate
+	from reportlab.platypus.doctemplate import LayoutError
+	from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+	from reportlab.lib.units import inch
+	from reportlab.pdfbase.pdfmetrics import stringWidth
+	from reportlab.lib.utils import simpleSplit
+
+	styleSheet = getSampleStyleSheet()
+	styleSheet.add(ParagraphStyle(name='Justify', alignment=TA_JUSTIFY))
+
+	styleSheet.add(
+		ParagraphStyle(
+			name='CodeNoIndent',
+			fontName='Courier',
+			fontSize=8,
+			leading=12,
+			firstLineIndent=0,
+			leftIndent=0,
+			spaceBefore=6
+		)
 	)
-)
-
-styles.add(
-	ParagraphStyle(
-		name='Small',
-		fontName='Times-Roman',
-		fontSize=8,
-		leading=12,
-		spaceBefore=6
+
+	styleSheet.add(
+		ParagraphStyle(
+			name='Small',
+			fontName='Times-Roman',
+			fontSize=8,
+			leading=12,
+			spaceBefore=6
+		)
 	)
-)
-
-styles.add(
-	ParagraphStyle(
-		name='SmallBold',
-		fontName='Times-Bold',
-		fontSize=8,
-		leading=12,
-		spaceBefore=6
+
+	styleSheet.add(
+		ParagraphStyle(
+			name='SmallBold',
+			fontName='Times-Bold',
+			fontSize=8,
+			leading=12,
+			spaceBefore=6
+		)
 	)
-)
-
-styles.add(
-	ParagraphStyle(
-		name='Caption',
-		fontName='Times-Italic',
-		fontSize=8,
-		leading=12,
-		spaceBefore=6,
-		alignment=TA_CENTER
+
+	styleSheet.add(
+		ParagraphStyle(
+			name='Caption',
+			fontName='Times-Italic',
+			fontSize=8,
+			leading=12,
+			spaceBefore=6,
+			alignment=TA_CENTER
+		)
 	)
-)
-
-tableStyleStandard = TableStyle([
-	('GRID', (0,0), (-1,-1), 1, colors.black),
-	('TEXTCOLOR',(0,1),(1,-1),colors.black),
-	('SIZE', (0,0), (-1,-1), 10),
-	('TOPPADDING', (0,0), (-1,-1), 1),
-	('BOTTOMPADDING', (0,0), (-1,-1), 2),
-	('LEFTPADDING', (0,0), (-1,-1), 5),
-	('RIGHTPADDING', (0,0), (-1,-1), 5),
-])
-
-tableStyleSmall = TableStyle([
-	('GRID', (0,0), (-1,-1), 1, colors.black),
-	('TEXTCOLOR',(0,1),(1,-1),colors.black),
-	('SIZE', (0,0), (-1,-1), 10),
-	('TOPPADDING', (0,0), (-1,-1), 0),
-	('BOTTOMPADDING', (0,0), (-1,-1), 0),
-	('LEFTPADDING', (0,0), (-1,-1), 3),
-	('RIGHTPADDING', (0,0), (-1,-1), 3),
-])
-
-tableStyle4col = TableStyle([
-	('GRID', (0,0), (-1,-1), 1, colors.black),
-	('TEXTCOLOR',(0,1),(1,-1),colors.black),
-	('SIZE', (0,0), (-1,-1), 10),
-	('BACKGROUND',(0,0),(0,-1),colors.lightgrey),
-	('BACKGROUND',(2,0),(2,-1),colors.lightgrey),
-	('TOPPADDING', (0,0), (-1,-1), 0),
-	('BOTTOMPADDING', (0,0), (-1,-1), 0),
-	('LEFTPADDING', (0,0), (-1,-1), 3),
-	('RIGHTPADDING', (0,0), (-1,-1), 3),
-])
-
-tableStyleImg = TableStyle([
-	('GRID', (0,0), (-1,-1), 1, colors.black),
-	('TEXTCOLOR',(0,1),(1,-1),colors.black),
-	('SIZE', (0,0), (-1,-1), 10),
-	('TOPPADDING', (0,0), (-1,-1), 3),
-	('BOTTOMPADDING', (0,0), (-1,-1), 3),
-	('LEFTPADDING', (0,0), (-1,-1), 3),
-	('RIGHTPADDING', (0,0), (-1,-1), 3),
-])
-
-tableStyleGray = TableStyle([
-	('GRID', (0,0), (-1,-1), 1, colors.black),
-	('TEXTCOLOR',(0,1),(1,-1),colors.black),
-	('BACKGROUND',(0,0),(2,0),colors.lightgrey),
-	('SIZE', (0,0), (-1,-1), 10),
-	('TOPPADDING', (0,0), (-1,-1), 3),
-	('BOTTOMPADDING', (0,0), (-1,-1), 3),
-	('LEFTPADDING', (0,0), (-1,-1), 3),
-	('RIGHTPADDING', (0,0), (-1,-1), 3),
-])
-
-Story = []
+
+	tableStyleStandard = TableStyle([
+		('GRID', (0,0), (-1,-1), 1, colors.black),
+		('TEXTCOLOR',(0,1),(1,-1),colors.black),
+		('SIZE', (0,0), (-1,-1), 10),
+		('TOPPADDING', (0,0), (-1,-1), 1),
+		('BOTTOMPADDING', (0,0), (-1,-1), 2),
+		('LEFTPADDING', (0,0), (-1,-1), 5),
+		('RIGHTPADDING', (0,0), (-1,-1), 5),
+	])
+
+	tableStyleSmall = TableStyle([
+		('GRID', (0,0), (-1,-1), 1, colors.black),
+		('TEXTCOLOR',(0,1),(1,-1),colors.black),
+		('SIZE', (0,0), (-1,-1), 10),
+		('TOPPADDING', (0,0), (-1,-1), 0),
+		('BOTTOMPADDING', (0,0), (-1,-1), 0),
+		('LEFTPADDING', (0,0), (-1,-1), 3),
+		('RIGHTPADDING', (0,0), (-1,-1), 3),
+	])
+
+	# compact EXIF tables: header row and plain-string cells; the fonts of the
+	# two rows of each tag are set by exifGroupTable()
+	tableStyleExif = TableStyle([
+		('GRID', (0,0), (-1,-1), 0.5, colors.black),
+		('BACKGROUND',(0,0),(-1,0),colors.lightgrey),
+		('FONT', (0,0), (-1,-1), 'Times-Roman', 8, 10),
+		('VALIGN', (0,0), (-1,-1), 'TOP'),
+		('TOPPADDING', (0,0), (-1,-1), 1),
+		('BOTTOMPADDING', (0,0), (-1,-1), 2),
+		('LEFTPADDING', (0,0), (-1,-1), 3),
+		('RIGHTPADDING', (0,0), (-1,-1), 3),
+	])
+
+	tableStyle4col = TableStyle([
+		('GRID', (0,0), (-1,-1), 1, colors.black),
+		('TEXTCOLOR',(0,1),(1,-1),colors.black),
+		('SIZE', (0,0), (-1,-1), 10),
+		('BACKGROUND',(0,0),(0,-1),colors.lightgrey),
+		('BACKGROUND',(2,0),(2,-1),colors.lightgrey),
+		('TOPPADDING', (0,0), (-1,-1), 0),
+		('BOTTOMPADDING', (0,0), (-1,-1), 0),
+		('LEFTPADDING', (0,0), (-1,-1), 3),
+		('RIGHTPADDING', (0,0), (-1,-1), 3),
+	])
+
+	tableStyleImg = TableStyle([
+		('GRID', (0,0), (-1,-1), 1, colors.black),
+		('TEXTCOLOR',(0,1),(1,-1),colors.black),
+		('SIZE', (0,0), (-1,-1), 10),
+		('TOPPADDING', (0,0), (-1,-1), 3),
+		('BOTTOMPADDING', (0,0), (-1,-1), 3),
+		('LEFTPADDING', (0,0), (-1,-1), 3),
+		('RIGHTPADDING', (0,0), (-1,-1), 3),
+	])
+
+	tableStyleGray = TableStyle([
+		('GRID', (0,0), (-1,-1), 1, colors.black),
+		('TEXTCOLOR',(0,1),(1,-1),colors.black),
+		('BACKGROUND',(0,0),(2,0),colors.lightgrey),
+		('SIZE', (0,0), (-1,-1), 10),
+		('TOPPADDING', (0,0), (-1,-1), 3),
+		('BOTTOMPADDING', (0,0), (-1,-1), 3),
+		('LEFTPADDING', (0,0), (-1,-1), 3),
+		('RIGHTPADDING', (0,0), (-1,-1), 3),
+	])
+
+	# set last, styles != None means everything is loaded
+	styles = styleSheet
 
 # ------- Header Section ----------------------------------------------------
 
-if printHeader:
+# digests printed in the report: [hashlib name, label]
+hashAlgorithms = [
+	['md5', 'MD5'],
+	['sha1', 'SHA-1'],
+	['sha256', 'SHA-256'],
+]
+
+# size of the blocks read while hashing
+hashChunkSize = 1024 * 1024
+
+# computes all the digests of hashAlgorithms in a single read of the file,
+# one block at a time (memory use does not depend on the file size);
+# returns a dictionary hashlib name -> hex digest (empty on errors)
+def fileDigests(original_filename, chunkSize=hashChunkSize):
+	try:
+		start = time.time()
+		f = open(original_filename ,'rb')
+
+		hashes = [hashlib.new(algorithm[0]) for algorithm in hashAlgorithms]
+		readBytes = 0
+		while True:
+			data = f.read(chunkSize)
+			if not data:
+				break
+			readBytes += len(data)
+			for hash in hashes:
+				hash.update(data)
+
+		f.close()
+
+		elapsed = time.time() - start
+		if (elapsed > 0):
+			print("Hashed %i kB in %.3fs (%.1f MB/s)"%(readBytes/1024, elapsed, readBytes / elapsed / 1024 / 1024))
+
+		ret = {}
+		for hash, algorithm in zip(hashes, hashAlgorithms):
+			ret[algorithm[0]] = hash.hexdigest()
+		return ret
+	except:
+		return {}
+
+def headerSection(filename, exifs, workDir):
+
+	from PIL import Image as PILImage
+
+	Story = []
+
+	# open image file and create an in-memory thumbnail
+
+	thumbnailFile = cStringIO.StringIO()
 
-	def fileMd5(original_filename):
-		try:
-			f = file(original_filename ,'rb')
-			
-			md5 = hashlib.md5()
-			while True:
-				data = f.read()
-				if not data:
-					break
-				md5.update(data)
-			md5String = md5.hexdigest()
-			
-			f.close()
-			return md5String
-		except:
-			return ""
-	
-	# open image file and create a thumbnail in tmp/thmb.jpg
-	
-	thumbnailFile = "tmp/thmb.jpg"
-	
 	try:
 		imageRef = PILImage.open(filename)
 		imageFormat = imageRef.format
@@ -392,26 +601,35 @@ if printHeader:
 		imageSize = "%sx%s"%(imageRef.size[0], imageRef.size[1])
 		imageWidth = imageRef.size[0]
 		imageHeight = imageRef.size[1]
-	
+
 	except:
 		print("Unable to open image file.")
 		print("Error: %s"%sys.exc_info()[1])
-		sys.exit(1)
-	
+		raise ReportError("Unable to open image file: %s"%sys.exc_info()[1])
+
 	try:
 		thumbWidth = int(3*inch)
 		thumbHeight = int(imageHeight * (float(thumbWidth) / float(imageWidth)))
+
+		# JPEG files are decoded directly at a reduced scale (1/2 to 1/8,
+		# via DCT scaling) not smaller than the thumbnail; does nothing on
+		# other formats. Format, mode and size must be read before this.
+		imageRef.draft(imageRef.mode, (thumbWidth, thumbHeight))
+
 		imageRef.thumbnail((thumbWidth, thumbHeight), PILImage.ANTIALIAS)
+		if (imageRef.mode not in ['RGB', 'L', 'CMYK']):
+			imageRef = imageRef.convert('RGB')
 		imageRef.save(thumbnailFile, "JPEG")
+		thumbnailFile.seek(0)
 	except:
 		print("Unable to save thumbnail of image file.")
 		print("Error: %s"%sys.exc_info()[1])
-		sys.exit(1)
-	
+		raise ReportError("Unable to save thumbnail of image file: %s"%sys.exc_info()[1])
+
 	Story.append(Paragraph("Image analysis report", styles["Title"]))
-	
+
 	im = Image(thumbnailFile, thumbWidth, thumbHeight)
-	
+
 	imgData = Table(
 		[
 			[
@@ -423,51 +641,66 @@ if printHeader:
 				Paragraph("%s kB"%(os.path.getsize(filename)/1024), styles["Small"])
 			],
 			[
-				Paragraph("File MD5:", styles["Small"]),
-				Paragraph("%s"%fileMd5(filename), styles["Small"])
-			],
-			[
-				Paragraph("Image format", styles["Small"]), 
+				Paragraph("Image format", styles["Small"]),
 				Paragraph(imageFormat, styles["Small"])
-			], 
+			],
 			[
-				Paragraph("Image mode", styles["Small"]), 
+				Paragraph("Image mode", styles["Small"]),
 				Paragraph(imageMode, styles["Small"])
 			],
 			[
-				Paragraph("Image size", styles["Small"]), 
+				Paragraph("Image size", styles["Small"]),
 				Paragraph("%s px"%imageSize, styles["Small"])
-			],	
-	
+			],
+
 		],
 		colWidths=[70, 234]
 	)
 	imgData.setStyle(tableStyleSmall)
-	
+
 	t=Table([[im, imgData]], colWidths=[3*inch+6, 310])
 	t.setStyle(tableStyleImg)
 	Story.append(t)
-	
+
+	# file digests, full width (a SHA-256 doesn't fit next to the thumbnail)
+	digests = fileDigests(filename)
+	hashData = []
+	for algorithm in hashAlgorithms:
+		hashData.append(
+			[
+				Paragraph("File %s:"%algorithm[1], styles["Small"]),
+				Paragraph("%s"%digests.get(algorithm[0], ""), styles["CodeNoIndent"])
+			]
+		)
+
+	hashTable = Table(hashData, colWidths=[70, 3*inch+246])
+	hashTable.setStyle(tableStyleSmall)
+	Story.append(hashTable)
+
 	Story.append(Spacer(10, 20))
 
+	return Story
+
 # ------- FileSystem Section ---------------------------------------------
 
-if printFS:
+def fileSystemSection(filename, exifs, workDir):
+
+	Story = []
 
 	Story.append(Paragraph("FileSystem data", styles['Heading2']))
-	
+
 	stats = os.stat(filename)
-	
+
 	# otherTags stores data in 2 column format (tag, value)
 	otherTags = []
-	
+
 	# attrs stores a list of attributes to append (if available) to otherTags
 	# [attribute tag - attribute descr - type]
 	# type:
 	#    0 - none (string)
 	#    1 - time
 	#    2 - binary
-	
+
 	attrs = [
 		['st_mode', 'Protection bits', 2],
 		['st_ino', 'Inode number', 0],
@@ -488,26 +721,26 @@ if printFS:
 		['st_creator', 'Creator (mac os specific)', 0],
 		['st_type', 'Type (mac os specific)', 0],
 	]
-	
+
 	for attr in attrs:
 		if (hasattr(stats, attr[0])):
 			value = getattr(stats, attr[0])
-			
+
 			if (attr[2] == 1):
 				value = time.ctime(value)
 			elif (attr[2] == 2):
 				value = bin(value)
-	
+
 			otherTags.append(
 				[
-					Paragraph(attr[1], styles["Small"]), 
+					Paragraph(attr[1], styles["Small"]),
 					Paragraph("%s"%value, styles["Small"])
 				]
 			)
-	
+
 	# osData stores data in 4 column format (tag1, value1, tag2, value2)
 	osData = []
-	
+
 	# takes data from otherTags and append (two by two) to osData
 	while True:
 		if (len(otherTags) >= 2):
@@ -519,71 +752,48 @@ if printFS:
 			otherTags.pop(0)
 		else:
 			break
-	
+
 	osDataTable = Table(osData, colWidths=[140, 125, 140, 125])
 	osDataTable.setStyle(tableStyle4col)
 	Story.append(osDataTable)
-	
+
 	Story.append(Spacer(10, 10))
 
+	return Story
+
 # ------- Previews Section ---------------------------------------------
 
-if printPreviews:
+def previewsSection(filename, exifs, workDir):
 
-	# read previews list with exiv2
-	print("Lauch EXIV2 to acquire previews list...")
+	from PIL import Image as PILImage
+
+	Story = []
+
+	# extract previews in the private workspace, the extracted files are
+	# the list of previews
+	prwDir = os.path.join(workDir, "prw")
+	os.mkdir(prwDir)
+
+	print("Lauch EXIV2 to extract preview images...")
 	command = [
 		"exiv2",
 		"-q",
-		"-p",
-		"p",
+		"-ep",
+		"-l",
+		prwDir,
 		filename
 	]
-	
-	try:
-		p = subprocess.Popen(command, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-	except:
-		print("\nUnable to run EXIF2. Is it installed and available?")
-		print("If not, you have to download it from http://www.exiv2.org/\n")
-		sys.exit(1)
-	
-	previews = []
-	while True:
-		o = p.stdout.readline()
-		if o == '' and p.poll() != None: break
-		previews.append(o)
-	retval = p.wait()
-	
+
+	readExiv2(command)
+
+	previews = sorted(os.listdir(prwDir))
+
 	if (len(previews) > 0):
 		Story.append(Paragraph("Preview thumbnails in image data", styles['Heading2']))
-			
-		# extract previews
-		prwDir = "tmp/prw"
-		
-		print("Lauch EXIV2 to extract preview images...")
-		command = [
-			"exiv2",
-			"-ep",
-			"-l",
-			prwDir,
-			filename
-		]
-		
-		try:
-			p = subprocess.Popen(command, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-		except:
-			print("\nUnable to run EXIF2. Is it installed and available?")
-			print("If not, you have to download it from http://www.exiv2.org/\n")
-			sys.exit(1)
-		
-		while True:
-			o = p.stdout.readline()
-			if o == '' and p.poll() != None: break		
-		retval = p.wait()
-	
-		for imageFile in os.listdir(prwDir):
+
+		for imageFile in previews:
 			imagePath = os.path.join(prwDir, imageFile)
-	
+
 			try:
 				imageRef = PILImage.open(imagePath)
 				imageFormat = imageRef.format
@@ -595,12 +805,12 @@ if printPreviews:
 				print("Unable to open preview image file \"%s\"."%imagePath)
 				print("Error: %s"%sys.exc_info()[1])
 				continue
-	
+
 			thumbWidth = 1.5*inch
 			thumbHeight = imageHeight * (float(thumbWidth) / float(imageWidth))
-			
+
 			im = Image(imagePath, thumbWidth, thumbHeight)
-			
+
 			imgData = Table(
 				[
 					[
@@ -608,261 +818,869 @@ if printPreviews:
 						Paragraph("%s kB"%(os.path.getsize(imagePath)/1024), styles["Small"])
 					],
 					[
-						Paragraph("Preview format", styles["Small"]), 
+						Paragraph("Preview format", styles["Small"]),
 						Paragraph(imageFormat, styles["Small"])
-					], 
+					],
 					[
-						Paragraph("Preview mode", styles["Small"]), 
+						Paragraph("Preview mode", styles["Small"]),
 						Paragraph(imageMode, styles["Small"])
 					],
 					[
-						Paragraph("Preview size", styles["Small"]), 
+						Paragraph("Preview size", styles["Small"]),
 						Paragraph("%s px"%imageSize, styles["Small"])
-					],	
-			
+					],
+
 				],
 				colWidths=[70, 329]
 			)
 			imgData.setStyle(tableStyleSmall)
-			
+
 			previewData = Table([[im, imgData]], colWidths=[115, 405])
 			previewData.setStyle(tableStyleImg)
-			
+
 			Story.append(previewData)
 
+	return Story
+
 # ------- MAP Section ----------------------------------------------------
 
-if printMap:
+def ratString2Deg(data):
+	try:
+		deg, min, sec = string.split(data, " ")
+		deg1, deg2 = string.split(deg, "/")
+		deg = float(deg1) / float(deg2)
+		min1, min2 = string.split(min, "/")
+		min = float(min1) / float(min2)
+		sec1, sec2 = string.split(sec, "/")
+		sec = float(sec1) / float(sec2)
+		ret = deg + (min/60) + (sec/60/60)
+		return ret
 
-	def ratString2Deg(data):
-		try:
-			deg, min, sec = string.split(data, " ")	 	
-		 	deg1, deg2 = string.split(deg, "/")
-		 	deg = float(deg1) / float(deg2) 	
-		 	min1, min2 = string.split(min, "/")
-		 	min = float(min1) / float(min2)
-			sec1, sec2 = string.split(sec, "/")
-		 	sec = float(sec1) / float(sec2)
-			ret = deg + (min/60) + (sec/60/60)
-			return ret
-		
-		except:
-			return None
-	
-	def deg2num(lat_deg, lon_deg, zoom):
-	  lat_rad = math.radians(lat_deg)
-	  n = 2.0 ** zoom
-	  xtile = int((lon_deg + 180.0) / 360.0 * n)
-	  ytile = int((1.0 - math.log(math.tan(lat_rad) + (1 / math.cos(lat_rad))) / math.pi) / 2.0 * n)
-	  return (xtile, ytile)
-	
-	def num2deg(xtile, ytile, zoom):
-	  n = 2.0 ** zoom
-	  lon_deg = xtile / n * 360.0 - 180.0
-	  lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * ytile / n)))
-	  lat_deg = math.degrees(lat_rad)
-	  return (lat_deg, lon_deg)
-	
-	def gpsUrl(lat, lon, zoom):
+	except:
+		return None
+
+def deg2num(lat_deg, lon_deg, zoom):
+  lat_rad = math.radians(lat_deg)
+  n = 2.0 ** zoom
+  xtile = int((lon_deg + 180.0) / 360.0 * n)
+  ytile = int((1.0 - math.log(math.tan(lat_rad) + (1 / math.cos(lat_rad))) / math.pi) / 2.0 * n)
+  return (xtile, ytile)
+
+def num2deg(xtile, ytile, zoom):
+  n = 2.0 ** zoom
+  lon_deg = xtile / n * 360.0 - 180.0
+  lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * ytile / n)))
+  lat_deg = math.degrees(lat_rad)
+  return (lat_deg, lon_deg)
+
+def gpsUrl(lat, lon, zoom):
+	(x, y) = deg2num(lat, lon, zoom)
+	imUrl = "http://tile.openstreetmap.org/%s/%s/%s.png"%(zoom, x, y)
+	#imUrl = "http://tah.openstreetmap.org/Tiles/tile/%s/%s/%s.png"%(zoom, x, y)
+	return imUrl
+
+# returns the PNG data of the tile containing lat/lon (or None), from
+# tileCache if any, else from the network (if not offline)
+def fetchTile(lat, lon, zoom, tileCache=None, offline=False):
+
+	import urllib2
+
+	if (tileCache != None):
 		(x, y) = deg2num(lat, lon, zoom)
-		imUrl = "http://tile.openstreetmap.org/%s/%s/%s.png"%(zoom, x, y)
-		#imUrl = "http://tah.openstreetmap.org/Tiles/tile/%s/%s/%s.png"%(zoom, x, y)
-		return imUrl
-	
-	def gpsImg(filename, lat, lon, zoom):
-		
-		x, y = deg2num(lat, lon, zoom)	
-		upperLeftLat, upperLeftLon = num2deg(x, y, zoom)
-		upperRightLat, upperRightLon = num2deg(x+1, y, zoom)
-		bottomLeftLat, bottomLeftLon = num2deg(x, y+1, zoom)
-		
-		#print("Upper Left: %s - %s"%(upperLeftLat, upperLeftLon))
-		#print("Upper Right: %s - %s"%(upperRightLat, upperRightLon))
-		#print("Bottom Left: %s - %s"%(bottomLeftLat, bottomLeftLon))
-		
-		deltaLat = upperLeftLat - bottomLeftLat
-		deltaLon = upperRightLon - upperLeftLon
-		
-		#print("X,Y: %s %s"%(dotX, dotY))
-		
-		try:
-			fileUrl = gpsUrl(lat, lon, zoom)
-			file = urllib.urlopen(fileUrl)
-			imRead = cStringIO.StringIO(file.read())
-			im = PIL.Image.open(imRead)
-			draw = ImageDraw.Draw(im)
-			
-			imgHeight, imgWidth = im.size 
-			
-			dotY = imgWidth - int(float((lat - bottomLeftLat) * imgHeight) / float(deltaLat))
-			dotX = int(float((lon - upperLeftLon) * imgWidth) / float(deltaLon))
-			
-			rectWidth = 10
-			draw.rectangle([dotX-rectWidth, dotY-rectWidth, dotX+rectWidth, dotY+rectWidth], outline=0)
-			im.save(filename)
-			
-			return 0
-		
-		except:
-			print("Unable to download image for GPS data from OpenStreetMap")
-			return 1
-	
-	def reverseGeocode(lat, lon, zoom):
-		try:
-			url = "http://nominatim.openstreetmap.org/reverse?format=xml&lat=%s&lon=%s&zoom=%s&addressdetails=1"%(lat, lon, zoom)
-			dom = minidom.parse(urllib.urlopen(url))
-			address = dom.getElementsByTagName('result')
-			if (len(address) >= 1):
-				return address[0].firstChild.toxml()
-			else:
-				print("Unable to reverse geocode the GPS data provided. Maybe OpenStreetMap Nominatim service is unavailable fot this place.")
-		except:
-			print("Unable to fetch reverse geocode data. Maybe OpenStreetMap Nominatim service is offline.")
+		return tileCache.get(zoom, x, y, offline)
+
+	if (offline):
+		return None
+
+	file = urllib2.urlopen(gpsUrl(lat, lon, zoom), timeout=networkTimeout)
+	data = file.read()
+	file.close()
+	return data
+
+# returns the tile as an in-memory PNG (or None on errors)
+def gpsImg(lat, lon, zoom, tileCache=None, offline=False):
+
+	from PIL import Image as PILImage
+	from PIL import ImageDraw
+
+	x, y = deg2num(lat, lon, zoom)
+	upperLeftLat, upperLeftLon = num2deg(x, y, zoom)
+	upperRightLat, upperRightLon = num2deg(x+1, y, zoom)
+	bottomLeftLat, bottomLeftLon = num2deg(x, y+1, zoom)
+
+	#print("Upper Left: %s - %s"%(upperLeftLat, upperLeftLon))
+	#print("Upper Right: %s - %s"%(upperRightLat, upperRightLon))
+	#print("Bottom Left: %s - %s"%(bottomLeftLat, bottomLeftLon))
+
+	deltaLat = upperLeftLat - bottomLeftLat
+	deltaLon = upperRightLon - upperLeftLon
+
+	#print("X,Y: %s %s"%(dotX, dotY))
+
+	try:
+		data = fetchTile(lat, lon, zoom, tileCache, offline)
+		if (data == None):
+			print("Map tile %s/%s/%s not available (not in cache and offline)"%(zoom, x, y))
 			return None
-		
+
+		imRead = cStringIO.StringIO(data)
+		im = PILImage.open(imRead)
+		draw = ImageDraw.Draw(im)
+
+		imgHeight, imgWidth = im.size
+
+		dotY = imgWidth - int(float((lat - bottomLeftLat) * imgHeight) / float(deltaLat))
+		dotX = int(float((lon - upperLeftLon) * imgWidth) / float(deltaLon))
+
+		rectWidth = 10
+		draw.rectangle([dotX-rectWidth, dotY-rectWidth, dotX+rectWidth, dotY+rectWidth], outline=0)
+		imgFile = cStringIO.StringIO()
+		im.save(imgFile, "PNG")
+		imgFile.seek(0)
+
+		return imgFile
+
+	except:
+		print("Unable to download image for GPS data from OpenStreetMap")
 		return None
-	
+
+# returns the name of the place at lat/lon: from the results cache, then
+# from the local geocoder (if any), then from Nominatim (if not offline)
+def reverseGeocode(lat, lon, zoom, offline=False):
+
+	key = (round(lat, geocodeCachePrecision), round(lon, geocodeCachePrecision), zoom)
+	if (key in geocodeCache):
+		return geocodeCache[key]
+
+	address = None
+
+	if (localGeocoder != None):
+		result = localGeocoder.lookup(lat, lon)
+		if (result != None):
+			address = "%s (about %.1f km)"%result
+
+	if (address == None and offline == False):
+		address = nominatimReverseGeocode(lat, lon, zoom)
+
+	if (address != None):
+		if (len(geocodeCache) >= geocodeCacheMaxSize):
+			geocodeCache.clear()
+		geocodeCache[key] = address
+
+	return address
+
+def nominatimReverseGeocode(lat, lon, zoom):
+
+	import urllib2
+	from xml.dom import minidom
+
+	try:
+		url = "http://nominatim.openstreetmap.org/reverse?format=xml&lat=%s&lon=%s&zoom=%s&addressdetails=1"%(lat, lon, zoom)
+		dom = minidom.parse(urllib2.urlopen(url, timeout=networkTimeout))
+		address = dom.getElementsByTagName('result')
+		if (len(address) >= 1):
+			return address[0].firstChild.toxml()
+		else:
+			print("Unable to reverse geocode the GPS data provided. Maybe OpenStreetMap Nominatim service is unavailable fot this place.")
+	except:
+		print("Unable to fetch reverse geocode data. Maybe OpenStreetMap Nominatim service is offline.")
+		return None
+
+	return None
+
+# runs each (function, args) of calls in its own thread and waits for all
+# of them, up to timeout seconds overall; returns the list of results,
+# with None for the calls not completed in time
+def runConcurrently(calls, timeout):
+
+	import threading
+
+	results = [None] * len(calls)
+
+	def worker(i, function, args):
+		results[i] = function(*args)
+
+	threads = []
+	for i in range(len(calls)):
+		(function, args) = calls[i]
+		thread = threading.Thread(target=worker, args=(i, function, args))
+		# late threads must not keep the process alive
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+
+	deadline = time.time() + timeout
+	for thread in threads:
+		thread.join(max(0, deadline - time.time()))
+
+	late = len([thread for thread in threads if thread.isAlive()])
+	if (late > 0):
+		print("Map data: %i requests not completed in %gs, ignored."%(late, timeout))
+
+	return list(results)
+
+# tileCache and offline: see Reporter
+def mapSection(filename, exifs, workDir, tileCache=None, offline=False):
+
+	Story = []
+
 	# search for GPS data
 	gpsDataLat = None
 	gpsDataLon = None
 	gpsDataLatRef = 1
 	gpsDataLonRef = 1
-	
-	for exif in exifs:
-		if (exif['key2'] == "GPSInfo" and exif['key3'] == "GPSLatitude"):
-			gpsDataLat = ratString2Deg(exif['raw'])
-		elif (exif['key2'] == "GPSInfo" and exif['key3'] == "GPSLongitude"):
-			gpsDataLon = ratString2Deg(exif['raw'])
-		elif (exif['key2'] == "GPSInfo" and exif['key3'] == "GPSLatitudeRef"):
-			if (exif['raw'] == 'S'):
-				gpsDataLatRef = -1
-		elif (exif['key2'] == "GPSInfo" and exif['key3'] == "GPSLongitudeRef"):
-			if (exif['raw'] == 'W'):
-				gpsDataLatRef = -1
-	
+
+	index = indexRecords(exifs)
+
+	def gpsRaw(key3):
+		found = index.get("Exif.GPSInfo.%s"%key3, [])
+		if (len(found) > 0):
+			return found[0]['raw']
+		return None
+
+	if (gpsRaw("GPSLatitude") != None):
+		gpsDataLat = ratString2Deg(gpsRaw("GPSLatitude"))
+	if (gpsRaw("GPSLongitude") != None):
+		gpsDataLon = ratString2Deg(gpsRaw("GPSLongitude"))
+	if (gpsRaw("GPSLatitudeRef") == 'S'):
+		gpsDataLatRef = -1
+	if (gpsRaw("GPSLongitudeRef") == 'W'):
+		gpsDataLonRef = -1
+
 	if (gpsDataLat and gpsDataLon):
-	
+
 		print("Downloading GPS map data...")
-	
+
 		Story.append(Paragraph("EXIF Location data", styles['Heading2']))
-	
+
 		lat = gpsDataLat * gpsDataLatRef
 		lon = gpsDataLon * gpsDataLonRef
-		
-		address = reverseGeocode(lat, lon, 14)
+
+		# all fetched at the same time, with a single deadline
+		(address, res1, res2, res3) = runConcurrently(
+			[
+				(reverseGeocode, (lat, lon, 14, offline)),
+				(gpsImg, (lat, lon, 7, tileCache, offline)),
+				(gpsImg, (lat, lon, 10, tileCache, offline)),
+				(gpsImg, (lat, lon, 13, tileCache, offline)),
+			],
+			mapTimeout
+		)
+
 		if (address != None):
 			Story.append(Paragraph("The photo seems to have been shot in: \"%s\""%address, styles['Normal']))
 			Story.append(Spacer(1, 10))
-	
+
 		imgDim = 2.3*inch
-		
-		res1 = gpsImg("tmp/temp01.png", lat, lon, 7)
-		if (res1 == 0): print(" - downloaded first map from OpenStreetMap.org")
-		res2 = gpsImg("tmp/temp02.png", lat, lon, 10)
-		if (res2 == 0): print(" - downloaded second map from OpenStreetMap.org")
-		res3 = gpsImg("tmp/temp03.png", lat, lon, 13)
-		if (res3 == 0): print(" - downloaded third map from OpenStreetMap.org")
-		
-		if (res1 == 0 and res2 == 0 and res3 == 0):
-		
-			im1 = Image("tmp/temp01.png", imgDim, imgDim)
-			im2 = Image("tmp/temp02.png", imgDim, imgDim)
-			im3 = Image("tmp/temp03.png", imgDim, imgDim)
-		
-			t=Table([[im1, im2, im3]], colWidths=[imgDim + 10, imgDim + 10, imgDim + 10])
+
+		if (res1 != None): print(" - first map ready")
+		if (res2 != None): print(" - second map ready")
+		if (res3 != None): print(" - third map ready")
+
+		# partial results: the missing maps are replaced by a note
+		if (res1 != None or res2 != None or res3 != None):
+
+			maps = []
+			for res in [res1, res2, res3]:
+				if (res != None):
+					maps.append(Image(res, imgDim, imgDim))
+				else:
+					maps.append(Paragraph("Map not available", styles['Caption']))
+
+			t=Table([maps], colWidths=[imgDim + 10, imgDim + 10, imgDim + 10])
 			t.setStyle(tableStyleImg)
 			Story.append(t)
-			
+
 			Story.append(Paragraph("Tiles provided by OpenStreetMap.org (c) OpenStreetMap contributors, CC-BY-SA", styles['Caption']))
-			
+
 			Story.append(Spacer(10, 20))
 
+	return Story
+
 # ------- EXIF Section ----------------------------------------------------
 
-if printExif:
+def exifDescrString(exif):
+	try:
+		return unicode(exif['descr'], "utf-8")
+	except:
+		return "Unable to decode string"
+
+def exifRawString(exif):
+	rawDataString = ""
+	if (len(exif['raw'].strip()) > 0):
+		try:
+			rawDataString = unicode("Raw data: %s"%str(exif['raw']), "utf-8")
+		except:
+			rawDataString = "Unable to decode string"
+	return rawDataString
+
+# header table and a two-rows table for each tag
+def exifTagTables(tags):
+
+	Story = []
+
+	headerData = [
+		[
+			Paragraph("Key", styles["Small"]),
+			Paragraph("Name", styles["Small"]),
+			Paragraph("Content", styles["Small"])
+		]
+	]
+	t=Table(headerData, colWidths=[30, 170, 330])
+	t.setStyle(tableStyleGray)
+	Story.append(t)
+	Story.append(Spacer(1, 2))
+
+	for exif in tags:
+
+		firstRow = [
+			Paragraph(str(exif['tag']), styles['Small']),
+			Paragraph("%s"%exif['key3'], styles['SmallBold']),
+			Paragraph(wrapString(exifDescrString(exif), numChars = 80), styles['Small'])
+		]
+
+		secondRow = [
+			"",
+			Paragraph("type: %s x %s"%(exif['varNumber'], exif['varType']), styles['Small']),
+			Paragraph(wrapString(exifRawString(exif), numChars = 65), styles['CodeNoIndent'])
+		]
+
+		elementData = [firstRow, secondRow]
+
+		t=Table(elementData, colWidths=[30, 170, 330])
+		t.setStyle(tableStyleSmall)
+		Story.append(t)
+
+		Story.append(Spacer(1, 2))
+
+	return Story
+
+# widths of the characters, by (font name, font size, character)
+charWidths = {}
+
+# text of a cell of the compact EXIF tables: a plain string, broken in
+# lines no wider than the column (plain strings are much cheaper to lay
+# out than Paragraphs); words too long for a line are cut
+def exifCell(text, width, fontName, fontSize=8):
+	width = width - 6
+	if ("\n" not in text and stringWidth(text, fontName, fontSize) <= width):
+		return text
+	lines = []
+	for line in simpleSplit(text, fontName, fontSize, width):
+		start = 0
+		used = 0
+		for i in range(len(line)):
+			charWidth = charWidths.get((fontName, fontSize, line[i]))
+			if (charWidth == None):
+				charWidth = stringWidth(line[i], fontName, fontSize)
+				charWidths[(fontName, fontSize, line[i])] = charWidth
+			if (used + charWidth > width and i > start):
+				lines.append(line[start:i])
+				start = i
+				used = 0
+			used += charWidth
+		lines.append(line[start:])
+	return "\n".join(lines)
+
+# a single splittable table for a group of tags, with the header row
+# repeated on each page
+def exifGroupTable(tags):
+
+	data = [["Key", "Name", "Content"]]
+	styleCommands = []
+
+	for exif in tags:
+
+		row = len(data)
+
+		data.append([
+			str(exif['tag']),
+			exifCell("%s"%exif['key3'], 170, 'Times-Bold'),
+			exifCell(exifDescrString(exif), 330, 'Times-Roman')
+		])
+
+		data.append([
+			"",
+			"type: %s x %s"%(exif['varNumber'], exif['varType']),
+			exifCell(exifRawString(exif), 330, 'Courier')
+		])
+
+		styleCommands.append(('FONT', (1,row), (1,row), 'Times-Bold', 8, 10))
+		styleCommands.append(('FONT', (2,row+1), (2,row+1), 'Courier', 8, 10))
+		styleCommands.append(('LINEABOVE', (0,row), (-1,row), 1, colors.black))
+
+	t = Table(data, colWidths=[30, 170, 330], repeatRows=1)
+	t.setStyle(tableStyleExif)
+	t.setStyle(TableStyle(styleCommands))
+	return t
+
+# compactExif: see Reporter
+def exifSection(filename, exifs, workDir, compactExif=True):
+
+	Story = []
+
+	# group the tags by first and second key (key1 -> key2 -> tags),
+	# sorted by tag number once for all the groups
+	groups = {}
+	for exif in sorted(exifs, key=lambda k: k['tag']):
+		groups.setdefault(str(exif['key1']), {}).setdefault(str(exif['key2']), []).append(exif)
+
+	for key1 in sorted(groups.keys()):
 
-	# set for first key
-	key1 = []
-	for element in exifs:
-		key1.append(str(element['key1']))
-	key1unique = sorted(set(key1))
-	
-	for key1 in key1unique:
-	
 		# section header
 		Story.append(Paragraph(str(key1), styles['Heading2']))
-	
-		# select unique values per key2
-		key2 = []
-		for element in exifs:
-			if (element['key1'] == key1): 
-				key2.append(str(element['key2']))
-			else:
-				continue
-		key2unique = sorted(set(key2))
-		
-		for key2 in key2unique:
-	
+
+		for key2 in sorted(groups[key1].keys()):
+
 			# section header
 			Story.append(Paragraph(str(key2), styles['Heading3']))
-			
-			headerData = [
-				[
-					Paragraph("Key", styles["Small"]), 
-					Paragraph("Name", styles["Small"]), 
-					Paragraph("Content", styles["Small"])
-				]
-			]
-			t=Table(headerData, colWidths=[30, 170, 330])
-			t.setStyle(tableStyleGray)
-			Story.append(t)
-			Story.append(Spacer(1, 2))
-			
-			for exif in sorted(exifs, key=lambda k: k['tag']) :
-				
-				if (exif['key1'] != key1): continue
-				if (exif['key2'] != key2): continue
-				
-				try:
-					descrString = unicode(exif['descr'], "utf-8")
-				except:
-					descString = "Unable to decode string"
-				
-				firstRow = [
-					Paragraph(str(exif['tag']), styles['Small']),
-					Paragraph("%s"%exif['key3'], styles['SmallBold']), 
-					Paragraph(wrapString(descrString, numChars = 80), styles['Small'])
-				]
-				
-				rawDataString = ""
-				if (len(exif['raw'].strip()) > 0):
-					try:
-						rawDataString = unicode("Raw data: %s"%str(exif['raw']), "utf-8")
-					except:
-						rawDataString = "Unable to decode string"
-			
-				secondRow = [
-					"", 
-					Paragraph("type: %s x %s"%(exif['varNumber'], exif['varType']), styles['Small']), 
-					Paragraph(wrapString(rawDataString, numChars = 65), styles['CodeNoIndent'])
-				]
-				
-				#print(exif['key'])
-				#print(rawDataString)
-			
-				elementData = [firstRow, secondRow]
-				
-				t=Table(elementData, colWidths=[30, 170, 330])
-				t.setStyle(tableStyleSmall)
-				Story.append(t)
-				
-				Story.append(Spacer(1, 2))
 
+			if compactExif:
+				Story.append(exifGroupTable(groups[key1][key2]))
+				Story.append(Spacer(1, 6))
+			else:
+				Story.extend(exifTagTables(groups[key1][key2]))
+
+	return Story
 
 # ------- DOC Generation ----------------------------------------------------
 
-doc = SimpleDocTemplate(reportFileName, pagesize=letter,
-                        rightMargin=40,leftMargin=40,
-                        topMargin=40,bottomMargin=40)
+# creates the private workspace of a report (removed by generateReport)
+# tempDir is the parent directory, defaults to the system temp dir
+def createWorkDir(tempDir=None):
+	try:
+		return tempfile.mkdtemp(prefix="exif2reporter-", dir=tempDir)
+	except:
+		print("Unable to create temp dir in \"%s\". Check permissions."%(tempDir or tempfile.gettempdir()))
+		raise ReportError("Unable to create temp dir: %s"%sys.exc_info()[1])
+
+# the report sections, in order: [name, function]; each function takes
+# (filename, exifs, workDir) and returns a list of flowables. Other
+# sections can be added to the list given to a Reporter. The map and exif
+# sections also get the settings of the Reporter (see sectionSettings).
+def defaultSections():
+	sections = []
+	if printHeader:
+		sections.append(['header', headerSection])
+	if printFS:
+		sections.append(['filesystem', fileSystemSection])
+	if printPreviews:
+		sections.append(['previews', previewsSection])
+	if printMap:
+		sections.append(['map', mapSection])
+	if printExif:
+		sections.append(['exif', exifSection])
+	return sections
+
+# sections describing the file on disk, left out of the reports of
+# in-memory data (they would describe the temporary copy)
+fileOnlySections = ['filesystem']
+
+class Reporter():
+
+	# builds PDF reports, and can be kept around to build many of them in
+	# the same process. Errors are raised as ReportError.
+	#
+	# sections: list of [name, function] (default: defaultSections())
+	# tempDir: parent directory of the workspace of each report
+	# layoutBudget: expected seconds for the PDF layout, a warning is
+	# printed when exceeded
+	# tileCache: map tiles cache (a tilecache.TileCache)
+	# offline: no network access, maps only from tileCache
+	# compactExif: one table per group of tags (True) or per tag (False)
+
+	def __init__(self, sections=None, tempDir=None, layoutBudget=None, tileCache=None, offline=False, compactExif=True):
+		if (sections == None):
+			sections = defaultSections()
+		self.sections = list(sections)
+		self.tempDir = tempDir
+		self.layoutBudget = layoutBudget
+		self.tileCache = tileCache
+		self.offline = offline
+		self.compactExif = compactExif
+		loadReportLab()
+
+	# keyword arguments of the section called name, besides (filename,
+	# exifs, workDir)
+	def sectionSettings(self, name):
+		if (name == 'map'):
+			return {'tileCache': self.tileCache, 'offline': self.offline}
+		if (name == 'exif'):
+			return {'compactExif': self.compactExif}
+		return {}
+
+	# report of an image file; written to output (file name or file-like
+	# object), or returned as a string with the PDF data if output is None
+	def report(self, filename, output=None):
+
+		if (os.path.isfile(filename) == False):
+			raise ReportError("Provided input file does not exist: \"%s\""%filename)
+
+		workDir = createWorkDir(self.tempDir)
+		try:
+			return self._build(filename, workDir, self.sections, output)
+		finally:
+			shutil.rmtree(workDir, ignore_errors=True)
+
+	# report of an image held in memory (a string), saved as name in the
+	# workspace for exiv2; same output as report()
+	def reportData(self, data, name="image.jpg", output=None):
+
+		workDir = createWorkDir(self.tempDir)
+		try:
+			filename = os.path.join(workDir, os.path.basename(name) or "image.jpg")
+			try:
+				f = open(filename, "wb")
+				f.write(data)
+				f.close()
+			except IOError, e:
+				raise ReportError("Unable to save image data in the workspace: %s"%e)
+
+			sections = [section for section in self.sections if section[0] not in fileOnlySections]
+			return self._build(filename, workDir, sections, output, cache=False)
+		finally:
+			shutil.rmtree(workDir, ignore_errors=True)
+
+	def _build(self, filename, workDir, sections, output, cache=True):
+
+		exifs = readExifs(filename, cache)
+
+		Story = []
+		for (name, function) in sections:
+			Story.extend(function(filename, exifs, workDir, **self.sectionSettings(name)))
+
+		if (output == None):
+			target = cStringIO.StringIO()
+		else:
+			target = output
+
+		doc = SimpleDocTemplate(target, pagesize=letter,
+		                        rightMargin=40,leftMargin=40,
+		                        topMargin=40,bottomMargin=40)
+
+		# the workspace must survive until here, previews are read by build()
+		start = time.time()
+		try:
+			doc.build(Story)
+		except IOError, e:
+			raise ReportError("Unable to write report: %s"%e)
+		except LayoutError, e:
+			# e.g. a tag value too long to fit in a page
+			raise ReportError("Unable to lay out report: %s"%e)
+		elapsed = time.time() - start
+
+		print("PDF layout time: %.3fs"%elapsed)
+		if (self.layoutBudget != None and elapsed > self.layoutBudget):
+			print("Warning: PDF layout took %.3fs, over the budget of %.3fs"%(elapsed, self.layoutBudget))
+
+		if (output == None):
+			return target.getvalue()
+		return output
+
+# report of filename saved as reportFileName (used by the command line)
+def generateReport(filename, reportFileName, tempDir=None):
+	reporter = Reporter(tempDir=tempDir, layoutBudget=layoutBudget, tileCache=tileCache, offline=offline, compactExif=compactExif)
+	reporter.report(filename, reportFileName)
+
+# ------- Batch Mode --------------------------------------------------------
+
+# true if pattern is to be expanded as a glob: an existing file whose name
+# contains [ or * is taken as it is
+def isGlob(pattern):
+	return glob.has_magic(pattern) and os.path.exists(pattern) == False
+
+# expands files, glob patterns and directories into a list of input files
+def collectInputs(patterns, dirs, listFiles):
+
+	inputs = []
+
+	for pattern in patterns:
+		if (isGlob(pattern) == False):
+			inputs.append(pattern)
+			continue
+		matches = sorted(glob.glob(pattern))
+		if (len(matches) == 0):
+			# keep it anyway, so it will be reported as failed
+			matches = [pattern]
+		inputs.extend(matches)
+
+	for dir in dirs:
+		for root, subDirs, files in os.walk(dir):
+			subDirs.sort()
+			for file in sorted(files):
+				if (os.path.splitext(file)[1].lower() in batchExtensions):
+					inputs.append(os.path.join(root, file))
+
+	for listFile in listFiles:
+		if (listFile == "-"):
+			lines = sys.stdin.readlines()
+		else:
+			f = open(listFile, "r")
+			lines = f.readlines()
+			f.close()
+		for line in lines:
+			line = line.strip()
+			if (len(line) > 0):
+				inputs.append(line)
+
+	# remove duplicates, keeping input order
+	seen = set()
+	ret = []
+	for input in inputs:
+		if (input in seen): continue
+		seen.add(input)
+		ret.append(input)
+	return ret
+
+# builds a unique report name inside outDir for each input file
+def batchReportNames(inputs, outDir):
+	names = []
+	used = set()
+	for input in inputs:
+		base = os.path.splitext(os.path.basename(input))[0]
+		name = base
+		count = 1
+		while (name in used):
+			count += 1
+			name = "%s_%i"%(base, count)
+		used.add(name)
+		names.append(os.path.join(outDir, "%s.pdf"%name))
+	return names
+
+# runs in the worker processes
+def batchWorker(job):
+	(filename, reportFileName, tempDir) = job
+	start = time.time()
+	try:
+		generateReport(filename, reportFileName, tempDir)
+		error = None
+	except Exception, e:
+		error = "%s"%e
+		if (len(error) == 0):
+			error = e.__class__.__name__
+	return (filename, reportFileName, time.time() - start, error)
+
+def runBatch(inputs, outDir, workers, tempDir=None):
+
+	import multiprocessing
+
+	# loaded once here, the workers inherit it
+	loadReportLab()
+
+	if (os.path.isdir(outDir) == False):
+		try:
+			os.makedirs(outDir)
+		except:
+			raise ReportError("Unable to create output dir: \"%s\""%outDir)
+
+	jobs = [(input, reportFileName, tempDir) for (input, reportFileName) in zip(inputs, batchReportNames(inputs, outDir))]
+
+	print("Generating %i reports in \"%s\" with %i workers..."%(len(jobs), outDir, workers))
+
+	start = time.time()
+	results = []
+
+	pool = multiprocessing.Pool(workers)
+	try:
+		for result in pool.imap_unordered(batchWorker, jobs):
+			results.append(result)
+			(filename, reportFileName, elapsed, error) = result
+			if (error == None):
+				print("[%i/%i] %s -> %s (%.2fs)"%(len(results), len(jobs), filename, reportFileName, elapsed))
+			else:
+				print("[%i/%i] %s FAILED: %s"%(len(results), len(jobs), filename, error))
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+	totalTime = time.time() - start
+
+	# summary, also saved in the output dir
+	positions = dict((input, i) for (i, input) in enumerate(inputs))
+	results = sorted(results, key=lambda r: positions[r[0]])
+	failed = [r for r in results if r[3] != None]
+
+	summary = []
+	summary.append("file\treport\tseconds\tstatus")
+	for (filename, reportFileName, elapsed, error) in results:
+		if (error == None):
+			status = "OK"
+		else:
+			status = "FAILED: %s"%error
+		summary.append("%s\t%s\t%.3f\t%s"%(filename, reportFileName, elapsed, status))
+
+	summaryFile = os.path.join(outDir, "summary.txt")
+	f = open(summaryFile, "w")
+	f.write("\n".join(summary) + "\n")
+	f.close()
+
+	print("")
+	print("Reports generated: %i, failed: %i, total time: %.2fs"%(len(results) - len(failed), len(failed), totalTime))
+	if (len(results) > 0):
+		print("Average time per report: %.2fs"%(sum([r[2] for r in results]) / len(results)))
+	for (filename, reportFileName, elapsed, error) in failed:
+		print(" - %s: %s"%(filename, error))
+	print("Summary saved in \"%s\""%summaryFile)
+
+	return results
+
+# ------- Main ---------------------------------------------------------------
+
+def main():
+
+	global tileCache, offline, mapTimeout, localGeocoder, compactExif, layoutBudget, metaCache
+
+	import multiprocessing
+	from tilecache import TileCache
+	from geocoder import LocalGeocoder
+	from metacache import MetaCache
+
+	patterns = []
+	dirs = []
+	listFiles = []
+	reportFileName = ""
+	outDir = "reports"
+	tempDir = None
+	tileCacheDir = None
+	tileCacheSize = 200
+	tileSeeds = []
+	workers = multiprocessing.cpu_count()
+
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "hf:o:d:l:O:j:t:", ["tile-cache=", "tile-cache-size=", "tile-seed=", "offline", "map-timeout=", "geocoder=", "per-tag-tables", "layout-budget=", "meta-cache="])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(0)
+
+	for o,a in opts:
+		if o == "-h":
+			usage()
+			sys.exit(0)
+		elif o == "-f":
+			patterns.append(a)
+		elif o == "-o":
+			reportFileName = a
+		elif o == "-d":
+			dirs.append(a)
+		elif o == "-l":
+			listFiles.append(a)
+		elif o == "-O":
+			outDir = a
+		elif o == "-t":
+			tempDir = a
+		elif o == "--tile-cache":
+			tileCacheDir = a
+		elif o == "--tile-cache-size":
+			try:
+				tileCacheSize = int(a)
+			except ValueError:
+				usage()
+				print("Invalid tiles cache size: \"%s\".\n"%a)
+				sys.exit(1)
+		elif o == "--tile-seed":
+			tileSeeds.append(a)
+		elif o == "--offline":
+			offline = True
+		elif o == "--geocoder":
+			try:
+				localGeocoder = LocalGeocoder(a)
+			except (IOError, ValueError), e:
+				print("Unable to open reverse geocoding index \"%s\": %s\n"%(a, e))
+				sys.exit(1)
+		elif o == "--meta-cache":
+			try:
+				# the batch workers inherit it
+				metaCache = MetaCache(a)
+			except Exception, e:
+				print("Unable to use metadata cache \"%s\": %s\n"%(a, e))
+				sys.exit(1)
+		elif o == "--per-tag-tables":
+			compactExif = False
+		elif o == "--layout-budget":
+			try:
+				layoutBudget = float(a)
+			except ValueError:
+				usage()
+				print("Invalid layout budget: \"%s\".\n"%a)
+				sys.exit(1)
+		elif o == "--map-timeout":
+			try:
+				mapTimeout = float(a)
+			except ValueError:
+				usage()
+				print("Invalid map timeout: \"%s\".\n"%a)
+				sys.exit(1)
+		elif o == "-j":
+			try:
+				workers = max(1, int(a))
+			except ValueError:
+				usage()
+				print("Invalid number of workers: \"%s\".\n"%a)
+				sys.exit(1)
+
+	if (len(patterns) == 0 and len(dirs) == 0 and len(listFiles) == 0):
+		usage()
+		print("You need to provide a in input file name.\n")
+		sys.exit(1)
+
+	# the batch workers inherit the cache
+	if (len(tileSeeds) > 0 and tileCacheDir == None):
+		usage()
+		print("Seed sources need a tiles cache dir (--tile-cache).\n")
+		sys.exit(1)
+
+	if (tileCacheDir != None):
+		try:
+			tileCache = TileCache(tileCacheDir, maxSize=tileCacheSize*1024*1024, seedSources=tileSeeds, offline=offline)
+		except OSError, e:
+			print("Unable to use tiles cache \"%s\": %s\n"%(tileCacheDir, e))
+			sys.exit(1)
+
+	# batch mode
+	if (len(patterns) > 1 or len(dirs) > 0 or len(listFiles) > 0 or isGlob(patterns[0])):
+
+		if (len(reportFileName) > 0):
+			usage()
+			print("The output file (-o) is for a single input file, use -O outdir for many.\n")
+			sys.exit(1)
+
+		inputs = collectInputs(patterns, dirs, listFiles)
+		if (len(inputs) == 0):
+			print("No input files found.\n")
+			sys.exit(1)
+
+		try:
+			results = runBatch(inputs, outDir, workers, tempDir)
+		except ReportError, e:
+			print("%s\n"%e)
+			sys.exit(1)
+
+		if (len([r for r in results if r[3] != None]) > 0):
+			sys.exit(1)
+		sys.exit(0)
+
+	# single file mode
+	filename = patterns[0]
+
+	if (len(reportFileName) == 0):
+		defaultReportFileName = "report.pdf"
+		print("Didn't provide an output file name. Using default: %s"%defaultReportFileName)
+		reportFileName = defaultReportFileName
+
+	# check file existence
+	if (os.path.isfile(filename) == 0):
+		usage()
+		print("Provided input file does not exist.\n")
+		sys.exit(1)
+
+	try:
+		generateReport(filename, reportFileName, tempDir)
+	except ReportError, e:
+		print("%s\n"%e)
+		sys.exit(1)
 
-doc.build(Story)
\ No newline at end of file
+if __name__ == "__main__":
+	main()
@@ -26,74 +26,798 @@
  
 '''
 
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
-import sys, string, logging
+# PIL (and PIL.ExifTags) and logging are imported when first needed, so
+# that the command line tool starts quickly
+import sys, os, string, struct
+
+# the logger of the module, configured once by getLogger()
+log = None
+
+def getLogger():
+	global log
+	if (log == None):
+		import logging
+		log = logging.getLogger('Exif Reader')
+		log.setLevel(logging.DEBUG)
+		#create console handler and set level to debug
+		ch = logging.StreamHandler()
+		ch.setLevel(logging.DEBUG)
+		#create formatter
+		formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+		#add formatter to ch
+		ch.setFormatter(formatter)
+		#add ch to logger
+		log.addHandler(ch)
+	return log
+
+# ------- EXIF Parser --------------------------------------------------------
+
+# TIFF field types: type -> [size of a value, struct format]; ASCII and
+# UNDEFINED are kept as strings
+tiffTypes = {
+	1: [1, "B"],		# BYTE
+	2: [1, None],		# ASCII
+	3: [2, "H"],		# SHORT
+	4: [4, "L"],		# LONG
+	5: [8, "L"],		# RATIONAL (two LONGs)
+	6: [1, "b"],		# SBYTE
+	7: [1, None],		# UNDEFINED
+	8: [2, "h"],		# SSHORT
+	9: [4, "l"],		# SLONG
+	10: [8, "l"],		# SRATIONAL (two SLONGs)
+	11: [4, "f"],		# FLOAT
+	12: [8, "d"],		# DOUBLE
+}
+
+# pointers to the Exif and GPS IFDs, in IFD0
+exifIfdTag = 34665
+gpsIfdTag = 34853
+
+# entries of an IFD above this are considered garbage
+maxIfdEntries = 1000
+
+# JPEG start of frame markers (baseline, progressive, lossless...)
+sofMarkers = [0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF]
+
+# JPEG markers without length
+standaloneMarkers = [0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7]
+
+# image mode by number of components (as PIL)
+jpegModes = {1: "L", 3: "RGB", 4: "CMYK"}
+
+# reads the markers of a JPEG file up to the first start of frame, never
+# the image data; returns (TIFF data of the EXIF segment, as a memoryview
+# over the segment, or None, width, height, components), or None if the
+# file is not a JPEG
+def readJpegHeader(filename):
+
+	f = open(filename, "rb")
+	try:
+		if (f.read(2) != "\xff\xd8"):
+			return None
+
+		tiff = None
+		while True:
+			# junk between the segments is skipped up to the next 0xFF
+			# (as PIL does)
+			byte = f.read(1)
+			while (len(byte) == 1 and byte != "\xff"):
+				byte = f.read(1)
+			marker = byte + f.read(1)
+			if (len(marker) < 2):
+				raise ValueError("Invalid JPEG marker")
+			# fill bytes
+			while (marker[1] == "\xff"):
+				marker = "\xff" + f.read(1)
+			code = ord(marker[1])
+
+			if (code in standaloneMarkers):
+				continue
+			# start of scan or end of image before any frame
+			if (code == 0xDA or code == 0xD9):
+				raise ValueError("No JPEG frame header")
+
+			length = struct.unpack(">H", f.read(2))[0] - 2
+			if (length < 0):
+				raise ValueError("Invalid JPEG segment length")
+
+			if (code in sofMarkers):
+				(precision, height, width, components) = struct.unpack(">BHHB", f.read(6))
+				return (tiff, width, height, components)
+
+			# APP1, only the first EXIF one (XMP is APP1 too)
+			if (code == 0xE1 and tiff == None and length >= 6):
+				data = f.read(length)
+				if (data[:6] == "Exif\0\0"):
+					tiff = memoryview(data)[6:]
+			else:
+				f.seek(length, 1)
+	finally:
+		f.close()
+
+# value of an IFD entry: a tuple of numbers (pairs for rationals), a
+# string (ASCII, without the final NUL) or a memoryview over the EXIF
+# data (UNDEFINED: MakerNote, UserComment... are never copied)
+def readIfdValue(data, endian, type, count, offset):
+
+	(size, format) = tiffTypes[type]
+	length = size * count
+	if (length <= 4):
+		valueOffset = offset + 8
+	else:
+		valueOffset = struct.unpack_from(endian + "L", data, offset + 8)[0]
+	if (valueOffset + length > len(data)):
+		raise ValueError("IFD value out of the EXIF data")
+
+	if (type == 7):
+		return data[valueOffset:valueOffset + length]
+
+	if (type == 2):
+		value = data[valueOffset:valueOffset + length].tobytes()
+		if (value[-1:] == "\0"):
+			value = value[:-1]
+		return value
+
+	if (type in [5, 10]):
+		numbers = struct.unpack_from("%s%i%s"%(endian, count * 2, format), data, valueOffset)
+		return tuple(zip(numbers[0::2], numbers[1::2]))
+
+	return struct.unpack_from("%s%i%s"%(endian, count, format), data, valueOffset)
+
+# single values are not kept in a tuple (as PIL does)
+def fixupValue(value):
+	if (len(value) == 1):
+		return value[0]
+	return value
+
+# reads the IFD at offset; returns a dictionary tag -> value
+def readIfd(data, endian, offset):
+
+	if (offset < 8 or offset + 2 > len(data)):
+		raise ValueError("IFD out of the EXIF data")
+
+	entries = struct.unpack_from(endian + "H", data, offset)[0]
+	if (entries > maxIfdEntries):
+		raise ValueError("Too many IFD entries")
+
+	ifd = {}
+	for i in range(entries):
+		entryOffset = offset + 2 + i * 12
+		if (entryOffset + 12 > len(data)):
+			break
+		(tag, type, count) = struct.unpack_from(endian + "HHL", data, entryOffset)
+		# unknown types and broken entries are skipped
+		if (type not in tiffTypes):
+			continue
+		try:
+			ifd[tag] = fixupValue(readIfdValue(data, endian, type, count, entryOffset))
+		except (ValueError, struct.error):
+			continue
+	return ifd
+
+# the tags of a TIFF block (the EXIF segment of a JPEG), IFD by IFD: a
+# list of (tag, value, IFD name) with the tags of IFD0 ("IFD0") then the
+# ones of the Exif IFD ("Exif"), the GPS IFD as a dictionary under its
+# tag ("GPS"). A tag found both in IFD0 and in the Exif IFD is listed
+# twice
+def parseExifEntries(tiff):
+
+	if (isinstance(tiff, memoryview) == False):
+		tiff = memoryview(tiff)
+
+	if (tiff[:4] == "II*\0"):
+		endian = "<"
+	elif (tiff[:4] == "MM\0*"):
+		endian = ">"
+	else:
+		raise ValueError("Invalid TIFF header")
+
+	ifd0 = readIfd(tiff, endian, struct.unpack_from(endian + "L", tiff, 4)[0])
+
+	# a pointer to an IFD that can not be read is dropped (its value is
+	# an offset, not the tags)
+	exifIfd = {}
+	if (exifIfdTag in ifd0):
+		try:
+			exifIfd = readIfd(tiff, endian, ifd0[exifIfdTag])
+		except (ValueError, TypeError, struct.error):
+			del ifd0[exifIfdTag]
+
+	# the GPS pointer belongs to IFD0, some writers put it in the Exif IFD
+	for ifd in [ifd0, exifIfd]:
+		if (gpsIfdTag in ifd):
+			try:
+				ifd[gpsIfdTag] = readIfd(tiff, endian, ifd[gpsIfdTag])
+			except (ValueError, TypeError, struct.error):
+				del ifd[gpsIfdTag]
+
+	entries = []
+	for (name, ifd) in [("IFD0", ifd0), ("Exif", exifIfd)]:
+		for tag in sorted(ifd.keys()):
+			if (tag == gpsIfdTag):
+				entries.append((tag, ifd[tag], "GPS"))
+			else:
+				entries.append((tag, ifd[tag], name))
+	return entries
+
+# the tags of a TIFF block as returned by PIL _getexif(): IFD0 and the
+# Exif IFD merged (the Exif IFD wins), the GPS IFD as a dictionary under
+# its tag; if ifds is given (a dictionary) it is filled with tag -> IFD
+# name ("IFD0", "Exif", "GPS" for the GPS tag)
+def parseExif(tiff, ifds=None):
+
+	if (ifds == None):
+		ifds = {}
+
+	exif = {}
+	for (tag, value, ifd) in parseExifEntries(tiff):
+		exif[tag] = value
+		ifds[tag] = ifd
+	return exif
+
+# hex dump tables: byte -> hex digits, and printable characters (the
+# others are shown as ".")
+hexDigits = ["%02X"%x for x in range(256)]
+hexDigits0x = ["0x%02X"%x for x in range(256)]
+hexFilter = ''.join([(len(repr(chr(x)))==3) and chr(x) or '.' for x in range(256)])
+
+# a string with the data of value (a string or a memoryview)
+def bytesOf(value):
+	if (isinstance(value, memoryview)):
+		return value.tobytes()
+	return value
+
+# ------- Tag Decoders --------------------------------------------------------
+
+# Each tag with a decoder in tagDecoders is interpreted by it:
+# decoder(exifData, value) returns (value to show, list of comments). The
+# other tags are shown as they are (rationals as numbers). More decoders
+# can be added with registerTagDecoder().
+
+orientationValues = {
+	1: "The 0th row is at the visual top of the image, and the 0th column is the visual left-hand side.",
+	2: "The 0th row is at the visual top of the image, and the 0th column is the visual right-hand side.",
+	3: "The 0th row is at the visual bottom of the image, and the 0th column is the visual right-hand side.",
+	4: "The 0th row is at the visual bottom of the image, and the 0th column is the visual left-hand side.",
+	5: "The 0th row is the visual left-hand side of the image, and the 0th column is the visual top.",
+	6: "The 0th row is the visual right-hand side of the image, and the 0th column is the visual top.",
+	7: "The 0th row is the visual right-hand side of the image, and the 0th column is the visual bottom.",
+	8: "The 0th row is the visual left-hand side of the image, and the 0th column is the visual bottom."
+}
+
+exposurePrograms = {
+	1: "Manual",
+	2: "Normal program",
+	3: "Aperture priority",
+	4: "Shutter priority",
+	5: "Creative program (biased toward depth of field)",
+	6: "Action program (biased toward fast shutter speed)",
+	7: "Portrait mode (for closeup photos with the background out of focus)",
+	8: "Landscape mode (for landscape photos with the background in focus)"
+}
+
+componentNames = {
+	0: "",
+	1: "Y",
+	2: "Cb",
+	3: "Cr",
+	4: "R",
+	5: "G",
+	6: "B"
+}
+
+meteringModes = {
+	0: "unknown",
+	1: "Average",
+	2: "CenterWeightedAverage",
+	3: "Spot",
+	4: "MultiSpot",
+	5: "Pattern",
+	6: "Partial",
+	255: "Mode reserved"
+}
+
+lightSources = {
+	0: "Unknown",
+	1: "Daylight",
+	2: "Fluorescent",
+	3: "Tungsten (incandescent light)",
+	4: "Flash",
+	9: "Fine weather",
+	10: "Cloudy weather",
+	11: "Shade",
+	12: "Daylight fluorescent (D 5700 - 7100K)",
+	13: "Day white fluorescent (N 4600 - 5400K)",
+	14: "Cool white fluorescent (W 3900 - 4500K)",
+	15: "White fluorescent (WW 3200 - 3700K)",
+	17: "Standard light A",
+	18: "Standard light B",
+	19: "Standard light C",
+	20: "D55",
+	21: "D65",
+	22: "D75",
+	23: "D50",
+	24: "ISO studio tungsten",
+	255: "other light source"
+}
+
+sensingMethods = {
+	1: "Not defined",
+	2: "One-chip color area sensor",
+	3: "Two-chip color area sensor",
+	4: "Three-chip color area sensor",
+	5: "Color sequential area sensor",
+	6: "Trilinear sensor",
+	7: "Color sequential linear"
+}
+
+fileSources = {
+	3: "Digital Still Camera"
+}
+
+sceneTypes = {
+	1: "A directly photographed image"
+}
+
+cfaColors = {
+	0: "RED",
+	1: "GRE",
+	2: "BLU",
+	3: "CYA",
+	4: "MAG",
+	5: "YEL",
+	6: "WHI"
+}
+
+# Orientation
+def decodeOrientation(exifData, value):
+	if (value > 0 and value <= 8):
+		return (value, [orientationValues[value]])
+	return (value, ["Value unknown."])
+
+# Resolution Unit
+def decodeResolutionUnit(exifData, value):
+	if (value == 2):
+		return (value, ["XResolution and YResolution measured in pixels/inch."])
+	elif (value == 3):
+		return (value, ["XResolution and YResolution measured in pixels/centimeter"])
+	return (value, [])
+
+# Exposure program
+def decodeExposureProgram(exifData, value):
+	return (value, [exposurePrograms.get(value, "Reserved value.")])
+
+# Gps Data
+# decoded
+def decodeGpsInfo(exifData, value):
+
+	comments = []
+
+	# not the dictionary of the GPS IFD (e.g. the offset of an IFD that
+	# could not be read): shown as it is
+	if (isinstance(value, dict) == False):
+		return (value, comments)
+
+	gpsData = exifData.decodeGpsData(exifData.getGpsData(value))
+
+	if (gpsData['lat']):
+		comments.append("Latitude: %.12f"%gpsData['lat'])
+	if (gpsData['lon']):
+		comments.append("Longitude: %.12f"%gpsData['lon'])
+	if (gpsData['imgDir'] and gpsData['imgDirRef']):
+		comments.append("Img dir: %.2f %s"%(gpsData['imgDir'], gpsData['imgDirRef']))
+	if (gpsData['timeStamp']):
+		comments.append("Timestamp: %s"%gpsData['timeStamp'])
+
+	for item in gpsData['other']:
+		comments.append("%s: %s"%(item[0], item[1]))
+
+	# clear value
+	return ("", comments)
+
+# Components Configuration
+def decodeComponentsConfiguration(exifData, value):
+
+	compString = ""
+
+	if (len(value) == 4):
+		for char in value:
+			if (ord(char) in componentNames):
+				compString += "%s "%componentNames[ord(char)]
+			else:
+				compString += "?? "
+
+	return (exifData.stringHex(value), [compString])
+
+# Metering Mode
+def decodeMeteringMode(exifData, value):
+	if (value in meteringModes):
+		return (value, ["Mode: %s"%meteringModes[value]])
+	return (value, ["Mode unknown"])
+
+# Light Source
+def decodeLightSource(exifData, value):
+	return (value, [lightSources.get(value, "Unknown value.")])
+
+# Flash
+def decodeFlash(exifData, value):
+
+	flashString = []
+
+	if (value & 0b00000001 == 0):
+		flashString.append("Flash did not fire.")
+	else:
+		flashString.append("Flash fired.")
+
+	if (value >> 1 & 0b00000011) == 0b00:
+		flashString.append("No strobe return detection function.")
+	elif (value >> 1 & 0b00000011) == 0b10:
+		flashString.append("Strobe return light not detected.")
+	elif (value >> 1 & 0b00000011) == 0b11:
+		flashString.append("Strobe return light detected.")
+
+	if (value >> 3 & 0b00000011) == 0b01:
+		flashString.append("Compulsory flash firing.")
+	if (value >> 3 & 0b00000011) == 0b10:
+		flashString.append("Compulsory flash suppression.")
+	if (value >> 3 & 0b00000011) == 0b11:
+		flashString.append("Flash in auto mode.")
+
+	if (value >> 6 & 0b00000001) == 0b1:
+		flashString.append("Red eye reduction supported.")
+
+	if (value >> 5 & 0b00000001) == 0b1:
+		flashString = [("No flash function.")]
+
+	# value in bin
+	return (bin(value), flashString)
+
+# Subject location
+def decodeSubjectLocation(exifData, value):
+
+	comments = ["Main subject of the photo in X: %s and Y: %s"%(value[0], value[1])]
+
+	if (len(value) == 3):
+		comments.append("Main subject in a circle of diameter %s"%(value[2]))
+	elif (len(value) == 4):
+		comments.append("Main subject in a rectangle of width %s and height %s"%(value[2], value[3]))
+
+	return (value, comments)
+
+# lines of the hex dump of value
+def hexDumpLines(exifData, value):
+	return [line for line in string.split(exifData.dumpHex(value, length=16), '\n') if len(line) > 0]
+
+# Maker Note
+# decoded by the decoder registered for the camera maker, if any, else
+# printed as hex data
+def decodeMakerNote(exifData, value):
+
+	make = exifData.searchExifKey(271)
+	if (make != None):
+		decoder = makerNoteDecoders.get(("%s"%make[2]).strip().lower())
+		if (decoder != None):
+			return decoder(exifData, value)
+
+	# clear value
+	return ("", hexDumpLines(exifData, value))
+
+# UserComment
+def decodeUserComment(exifData, value):
+	return (value, hexDumpLines(exifData, value))
+
+#Color Space
+def decodeColorSpace(exifData, value):
+	if (value == 1):
+		return (value, ["sRGB"])
+	return (value, ["Uncalibrated"])
+
+# Sensing Method
+def decodeSensingMethod(exifData, value):
+	return (value, [sensingMethods.get(value, "Value unknown.")])
+
+# File Source
+def decodeFileSource(exifData, value):
+	return (exifData.stringHex(value), [fileSources.get(ord(value), "Value unknown")])
+
+# Scene Type
+def decodeSceneType(exifData, value):
+	return (exifData.stringHex(value), [sceneTypes.get(ord(value), "Value unknown")])
+
+# CFA Pattern
+def decodeCfaPattern(exifData, value):
+
+	comments = []
+
+	if (len(value) >= 4):
+		horRep = (ord(value[0]) * 16) + ord(value[1])
+		verRep = (ord(value[2]) * 16) + ord(value[3])
+		comments.append("Horizontal repeat pixel unit: %i"%horRep)
+		comments.append("Vertical repeat pixel unit: %i"%verRep)
+
+	pos = 0
+	row = ""
+	for char in value[4:]:
+		pos += 1
+		if (ord(char) in cfaColors):
+			row = "%s%s "%(row,cfaColors[ord(char)])
+		else:
+			row += "??? "
+		if (pos >= verRep):
+			comments.append(row)
+			row = ""
+			pos = 0
+
+	return (exifData.stringHex(value), comments)
+
+# tag number -> decoder
+tagDecoders = {
+	274: decodeOrientation,
+	296: decodeResolutionUnit,
+	34850: decodeExposureProgram,
+	34853: decodeGpsInfo,
+	37121: decodeComponentsConfiguration,
+	37383: decodeMeteringMode,
+	37384: decodeLightSource,
+	37385: decodeFlash,
+	37396: decodeSubjectLocation,
+	37500: decodeMakerNote,
+	37510: decodeUserComment,
+	40961: decodeColorSpace,
+	41495: decodeSensingMethod,
+	41728: decodeFileSource,
+	41729: decodeSceneType,
+	41730: decodeCfaPattern,
+}
+
+# camera maker (Make tag, lowercase) -> MakerNote decoder, same signature
+# as the tag decoders
+makerNoteDecoders = {}
+
+def registerTagDecoder(tag, decoder):
+	tagDecoders[tag] = decoder
+
+def registerMakerNoteDecoder(make, decoder):
+	makerNoteDecoders[make.strip().lower()] = decoder
+
+# ------- Metadata Cache ------------------------------------------------------
+
+# metadata cache (a metacache.MetaCache, see -c) used by ExifData.openFile
+metaCache = None
+
+# kind of the entries of ExifData in the metadata cache; to be changed
+# when what openFile() reads changes, so old entries are not used
+metaCacheKind = "exifviewer-2"
+
+# value with its memoryviews (UNDEFINED tags, also in the GPS dictionary)
+# copied to strings, to be pickled
+def plainValue(value):
+	if (isinstance(value, memoryview)):
+		return value.tobytes()
+	if (isinstance(value, dict)):
+		return dict([(key, plainValue(item)) for (key, item) in value.items()])
+	return value
+
+# ------- Tag Storage ---------------------------------------------------------
+
+# one tag of ExifData.exifs; reads as the [tag number, tag description,
+# value] list used before (element[0], tag, decoded, value = element),
+# with __slots__ it takes about half the memory of the list. ifd is the
+# name of the IFD the tag was read from (see parseExif)
+class ExifTag(object):
+
+	__slots__ = ('tag', 'decoded', 'value', 'ifd')
+
+	def __init__(self, tag, decoded, value, ifd="IFD0"):
+		self.tag = tag
+		# the same description string is shared by the tags of all the
+		# files
+		if (isinstance(decoded, str)):
+			decoded = intern(decoded)
+		self.decoded = decoded
+		self.value = value
+		self.ifd = ifd
+
+	def __getitem__(self, index):
+		return (self.tag, self.decoded, self.value)[index]
+
+	def __setitem__(self, index, value):
+		setattr(self, ('tag', 'decoded', 'value')[index], value)
+
+	def __len__(self):
+		return 3
+
+	def __iter__(self):
+		return iter((self.tag, self.decoded, self.value))
+
+	def __repr__(self):
+		return repr(list(self))
+
+# tag description -> tuple of the tag numbers with that description
+# (CFAPattern, SubjectLocation, ExposureIndex... are both in TIFF/EP and
+# in EXIF), shared by all the ExifData objects (built on first use from
+# PIL.ExifTags)
+tagNumbers = {}
+
+# the tag numbers of name, in ascending order; a number (the description
+# of the tags unknown to PIL) is its own tag number; None if unknown
+def tagNumbersOf(name):
+	if (len(tagNumbers) == 0):
+		from PIL.ExifTags import TAGS
+		for tag in sorted(TAGS.keys()):
+			tagNumbers[TAGS[tag]] = tagNumbers.get(TAGS[tag], ()) + (tag,)
+	if (isinstance(name, int)):
+		return (name,)
+	return tagNumbers.get(name)
 
 class ExifData():
 	
-	# exif data saved in self.exifs as:
+	# exif data saved in self.exifs as ExifTag records:
 	# [tag number, tag description, value]
+	# sorted by tag number, and indexed by self.exifsByTag: tag number ->
+	# (first, last) positions of its elements in self.exifs, last
+	# excluded (a tag can be found in more than one IFD, its elements are
+	# next to each other)
 	
 	def __init__(self):
 
 		# ----------- Globals -------------------------------------------------------------------------------
 		
 		self.exifs = []
+		self.exifsByTag = {}
 		self.filename = []
-
-		# ----------- Logger --------------------------------------------------------------------------------
-
-		# Logger
-		self.log = logging.getLogger('Exif Reader')
-		self.log.setLevel(logging.DEBUG)
-		#create console handler and set level to debug
-		ch = logging.StreamHandler()
-		ch.setLevel(logging.DEBUG)
-		#create formatter
-		formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
-		#add formatter to ch
-		ch.setFormatter(formatter)
-		#add ch to logger
-		self.log.addHandler(ch)	
 	
 	def openFile(self, filename):
 	
 		# ----------- Open File Data ------------------------------------------------------------------------
 		
+		# an instance can be reused for another file
+		self.exifs = []
+		self.exifsByTag = {}
+		self.filename = []
+
+		# files not changed since they were cached are not read
+		key = None
+		if (metaCache != None):
+			(key, state) = metaCache.lookup(metaCacheKind, filename)
+			if (state != None):
+				return self._restoreState(filename, state)
+
 		try:
-			imageRef = Image.open(filename)
-			
-			info = imageRef._getexif()
-			for tag, value in info.items():
+			from PIL.ExifTags import TAGS
+
+			# JPEG files: only the headers are read, the other formats
+			# go through PIL
+			header = readJpegHeader(filename)
+			if (header != None):
+				(tiff, width, height, components) = header
+				if (tiff == None):
+					raise ValueError("No EXIF data")
+				entries = parseExifEntries(tiff)
+				self.imageFormat = "JPEG"
+				self.imageMode = jpegModes.get(components, "unknown")
+			else:
+				from PIL import Image
+				imageRef = Image.open(filename)
+				info = imageRef._getexif()
+				# PIL merges the IFDs (a tag found in both is kept
+				# once): the tags of the TIFF directory are IFD0, the
+				# others Exif
+				ifds = {gpsIfdTag: "GPS"}
+				for tag in getattr(imageRef, "tag_v2", {}).keys():
+					ifds.setdefault(tag, "IFD0")
+				entries = [(tag, value, ifds.get(tag, "Exif")) for (tag, value) in info.items()]
+				(width, height) = imageRef.size
+				self.imageFormat = imageRef.format
+				self.imageMode = imageRef.mode
+
+			# a tag found in more than one IFD gives one element for each
+			for (tag, value, ifd) in entries:
 				decoded = TAGS.get(tag, tag)
-				self.exifs.append([tag, decoded, value])
-			self.exifs = sorted(self.exifs, key=lambda ret: ret[0])
+				self.exifs.append(ExifTag(tag, decoded, value, ifd))
+			self.indexExifs()
 			self.filename = filename
 			
-			self.imageFormat = imageRef.format
-			self.imageMode = imageRef.mode
-			self.imageSize = "%sx%s"%(imageRef.size[0], imageRef.size[1])
-			self.imageWidth = imageRef.size[0]
-			self.imageHeight = imageRef.size[1]
+			self.imageSize = "%sx%s"%(width, height)
+			self.imageWidth = width
+			self.imageHeight = height
+
+			if (metaCache != None):
+				metaCache.store(metaCacheKind, key, self._cacheState())
 			
 			return 0
 		except:
-			self.log.error("Error while initializing EXIF data from input file.")
-			self.log.debug("Error: %s"%sys.exc_info()[1])
+			error = sys.exc_info()[1]
+			# files that can not be parsed are cached too, not the ones
+			# that could not be read (errno set: missing, permissions...)
+			if (metaCache != None and getattr(error, "errno", None) == None):
+				metaCache.store(metaCacheKind, key, {'error': "%s"%error})
+			getLogger().error("Error while initializing EXIF data from input file.")
+			getLogger().debug("Error: %s"%error)
 			return 1
 
+	# the data of the file, as saved in the metadata cache: plain values
+	# (no memoryviews), descriptions included so that PIL is not needed
+	# to restore it
+	def _cacheState(self):
+		state = {}
+		state['format'] = self.imageFormat
+		state['mode'] = self.imageMode
+		state['width'] = self.imageWidth
+		state['height'] = self.imageHeight
+		state['tags'] = [(element.tag, element.decoded, plainValue(element.value), element.ifd) for element in self.exifs]
+		return state
+
+	# sets the data of filename from the metadata cache; returns as
+	# openFile()
+	def _restoreState(self, filename, state):
+
+		if ('error' in state):
+			getLogger().error("Error while initializing EXIF data from input file.")
+			getLogger().debug("Error: %s"%state['error'])
+			return 1
+
+		self.exifs = [ExifTag(tag, decoded, value, ifd) for (tag, decoded, value, ifd) in state['tags']]
+		self.indexExifs()
+		self.filename = filename
+
+		self.imageFormat = state['format']
+		self.imageMode = state['mode']
+		self.imageSize = "%sx%s"%(state['width'], state['height'])
+		self.imageWidth = state['width']
+		self.imageHeight = state['height']
+
+		return 0
+
+	# sorts self.exifs by tag number and rebuilds self.exifsByTag (to be
+	# called after changing self.exifs)
+	def indexExifs(self):
+		self.exifs.sort(key=lambda element: element[0])
+		self.exifsByTag = {}
+		for i in range(len(self.exifs)):
+			tag = self.exifs[i][0]
+			self.exifsByTag[tag] = (self.exifsByTag.get(tag, (i,))[0], i + 1)
+
+	# all the elements with tag number key (empty list if none)
+	def searchExifKeyAll(self, key):
+		positions = self.exifsByTag.get(key)
+		if (positions == None):
+			return []
+		return self.exifs[positions[0]:positions[1]]
+
+	# all the elements with tag description name (empty list if none);
+	# tags unknown to PIL are described by their number. Descriptions not
+	# known to PIL (set by hand) are looked for in all the elements
+	def searchExifNameAll(self, name):
+		keys = tagNumbersOf(name)
+		if (keys == None):
+			return [element for element in self.exifs if element[1] == name]
+		elements = []
+		for key in keys:
+			elements.extend([element for element in self.searchExifKeyAll(key) if element[1] == name])
+		return elements
+
+	# first element with tag number key, or None
 	def searchExifKey(self, key):
-		for element in self.exifs:
-			if (element[0] == key):
-				return element
-		return None
+		elements = self.searchExifKeyAll(key)
+		if (len(elements) == 0):
+			return None
+		return elements[0]
 
+	# first element with tag description name, or None
 	def searchExifName(self, name):
-		for element in self.exifs:
-			if (element[1] == name):
-				return element
-		return None
+		elements = self.searchExifNameAll(name)
+		if (len(elements) == 0):
+			return None
+		return elements[0]
+
+	# batch lookup: the first element of each tag number (or description)
+	# in keys, None where missing, in the same order as keys
+	def searchExifKeys(self, keys):
+		return [self.searchExifKey(key) for key in keys]
+
+	def searchExifNames(self, names):
+		return [self.searchExifName(name) for name in names]
 
 	def _convert_to_degrees(self, value):
 		d0 = value[0][0]
@@ -123,13 +847,14 @@ class ExifData():
 				gpsValue = gpsTag[2]
 		
 		if (gpsValue != None):
+			from PIL.ExifTags import GPSTAGS
 			gps_data = {}
 			for t in gpsValue:
 				sub_decoded = GPSTAGS.get(t, t)
 				gps_data[sub_decoded] = gpsValue[t]
 			return gps_data
 		else:
-			self.log.debug("Did not find GPS data in EXIF data.")
+			getLogger().debug("Did not find GPS data in EXIF data.")
 			return None
 	
 	def decodeGpsData(self, gpsData):
@@ -207,36 +932,43 @@ class ExifData():
 		# append unused fields 
 		for item in gpsData.keys():
 			if (item not in usedFields):
-				ret['other'].append([item, gpsData[item]])
+				ret['other'].append([item, bytesOf(gpsData[item])])
 			
 		return ret
 
+	# src can be a string or a memoryview (UNDEFINED values). Only the
+	# bytes that fit in limit characters of output are read; they are
+	# converted all at once (hex digits and printable characters), then
+	# cut in rows.
 	def dumpHex(self, src, length=8, limit=10000):
-		FILTER=''.join([(len(repr(chr(x)))==3) and chr(x) or '.' for x in range(256)])
-		N=0; result=''
-		while src:
-			s,src = src[:length],src[length:]
-			hexa = ' '.join(["%02X"%ord(x) for x in s])
-			s = s.translate(FILTER)
-			result += "%04X   %-*s   %s\n" % (N, length*3, hexa, s)
-			N+=length
-			if (len(result) > limit):
-				src = "";
-				result += "(analysis limit reached after %i bytes)"%limit
-		return result
+		# each row is longer than 4 * length + 10 characters
+		block = bytesOf(src[:(limit // (4 * length + 10) + 1) * length])
+		hexa = ' '.join(map(hexDigits.__getitem__, bytearray(block)))
+		text = block.translate(hexFilter)
+		rows = []
+		size = 0
+		for N in xrange(0, len(block), length):
+			row = "%04X   %-*s   %s\n" % (N, length*3, hexa[N*3:(N+length)*3-1], text[N:N+length])
+			rows.append(row)
+			size += len(row)
+			if (size > limit):
+				rows.append("(analysis limit reached after %i bytes)"%limit)
+				break
+		return ''.join(rows)
 	
 	def stringHex(self, src, length=16, limit=16):
-		FILTER=''.join([(len(repr(chr(x)))==3) and chr(x) or '.' for x in range(256)])
-		N=0; result=''
-		while src:
-			s,src = src[:length],src[length:]
-			hexa = ' '.join(["0x%02X"%ord(x) for x in s])
-			s = s.translate(FILTER)
-			result += "%-*s" % (length*3, hexa)
-			N+=length
-			if (len(result) > limit):
-				src = "";
-		return result	
+		# each row is at least 3 * length characters
+		block = bytesOf(src[:(limit // (3 * length) + 1) * length])
+		hexa = ' '.join(map(hexDigits0x.__getitem__, bytearray(block)))
+		rows = []
+		size = 0
+		for N in xrange(0, len(block), length):
+			row = "%-*s" % (length*3, hexa[N*5:(N+length)*5-1])
+			rows.append(row)
+			size += len(row)
+			if (size > limit):
+				break
+		return ''.join(rows)
 	
 	def valInHex(self, passedTag):
 			return self.dumpHex(passedTag['value'], length=16)
@@ -247,311 +979,20 @@ class ExifData():
 		decoded = passedTag[1]
 		value = passedTag[2]
 	
-		returnString = ""
-		
-		comments = []
-	
-		# Orientation
-		if (tag == 274):
-			
-			values = {
-				1: "The 0th row is at the visual top of the image, and the 0th column is the visual left-hand side.",
-				2: "The 0th row is at the visual top of the image, and the 0th column is the visual right-hand side.",
-				3: "The 0th row is at the visual bottom of the image, and the 0th column is the visual right-hand side.",
-				4: "The 0th row is at the visual bottom of the image, and the 0th column is the visual left-hand side.",
-				5: "The 0th row is the visual left-hand side of the image, and the 0th column is the visual top.",
-				6: "The 0th row is the visual right-hand side of the image, and the 0th column is the visual top.",
-				7: "The 0th row is the visual right-hand side of the image, and the 0th column is the visual bottom.",
-				8: "The 0th row is the visual left-hand side of the image, and the 0th column is the visual bottom."
-			}
-			
-			if (value > 0 and value <= 8):
-				comments.append(values[value])	
-			else:
-				comments.append("Value unknown.")				
-		
-		# Resolution Unit
-		elif (tag == 296):
-			
-			if (value == 2):
-				comments.append("XResolution and YResolution measured in pixels/inch.")
-			elif (value == 3):
-				comments.append("XResolution and YResolution measured in pixels/centimeter")
-
-		# Exposure program
-		elif (tag == 34850):
-
-			values = {
-				1: "Manual",
-				2: "Normal program",
-				3: "Aperture priority",
-				4: "Shutter priority",
-				5: "Creative program (biased toward depth of field)",
-				6: "Action program (biased toward fast shutter speed)",
-				7: "Portrait mode (for closeup photos with the background out of focus)",
-				8: "Landscape mode (for landscape photos with the background in focus)"
-			}
-			
-			if (value in values):
-				comments.append(values[value])
-			else:
-				comments.append("Reserved value.")
-										
-		# Gps Data
-		# decoded
-		elif (tag == 34853):
-
-			gpsData = self.decodeGpsData(self.getGpsData(value))
-			
-			if (gpsData['lat']):
-				comments.append("Latitude: %.12f"%gpsData['lat'])
-			if (gpsData['lon']):
-				comments.append("Longitude: %.12f"%gpsData['lon'])
-			if (gpsData['imgDir'] and gpsData['imgDirRef']):
-				comments.append("Img dir: %.2f %s"%(gpsData['imgDir'], gpsData['imgDirRef']))
-			if (gpsData['timeStamp']):
-				comments.append("Timestamp: %s"%gpsData['timeStamp'])
-			
-			for item in gpsData['other']:
-				comments.append("%s: %s"%(item[0], item[1]))
-
-			# clear value
-			value = ""
-
-		# Components Configuration
-		elif (tag == 37121):
-			
-			values = {
-				0: "",
-				1: "Y",
-				2: "Cb",
-				3: "Cr",
-				4: "R",
-				5: "G",
-				6: "B"
-			}
-			
-			compString = ""
-			
-			if (len(value) == 4):
-				for char in value:
-					if (ord(char) in values):
-						compString += "%s "%values[ord(char)]
-					else:
-						compString += "?? "
-
-			value = self.stringHex(value)
-			comments.append(compString)
-			
-		# Metering Mode
-		elif (tag == 37383):
-		
-			values = {
-				0: "unknown",
-				1: "Average",
-				2: "CenterWeightedAverage",
-				3: "Spot",
-				4: "MultiSpot",
-				5: "Pattern",
-				6: "Partial",
-				255: "Mode reserved"				
-			}
-			
-			if (value in values):
-				comments.append("Mode: %s"%values[value])
-			else:
-				comments.append("Mode unknown")	
-
-		# Light Source
-		elif (tag == 37384):
-			
-			values = {
-				0: "Unknown",
-				1: "Daylight",
-				2: "Fluorescent",
-				3: "Tungsten (incandescent light)",
-				4: "Flash",
-				9: "Fine weather",
-				10: "Cloudy weather",
-				11: "Shade",
-				12: "Daylight fluorescent (D 5700 - 7100K)",
-				13: "Day white fluorescent (N 4600 - 5400K)",
-				14: "Cool white fluorescent (W 3900 - 4500K)",
-				15: "White fluorescent (WW 3200 - 3700K)",
-				17: "Standard light A",
-				18: "Standard light B",
-				19: "Standard light C",
-				20: "D55",
-				21: "D65",
-				22: "D75",
-				23: "D50",
-				24: "ISO studio tungsten",
-				255: "other light source"
-			}
-			
-			if (value in values):
-				comments.append(values[value])
-			else:
-				comments.append("Unknown value.")
-
-		# Flash
-		elif (tag == 37385):
-			
-			flashString = []
-			
-			if (value & 0b00000001 == 0):
-				flashString.append("Flash did not fire.")
-			else:
-				flashString.append("Flash fired.")
-			
-			if (value >> 1 & 0b00000011) == 0b00:
-				flashString.append("No strobe return detection function.")
-			elif (value >> 1 & 0b00000011) == 0b10:
-				flashString.append("Strobe return light not detected.")
-			elif (value >> 1 & 0b00000011) == 0b11:
-				flashString.append("Strobe return light detected.")
-			
-			if (value >> 3 & 0b00000011) == 0b01:
-				flashString.append("Compulsory flash firing.")
-			if (value >> 3 & 0b00000011) == 0b10:
-				flashString.append("Compulsory flash suppression.")
-			if (value >> 3 & 0b00000011) == 0b11:
-				flashString.append("Flash in auto mode.")						
-			
-			if (value >> 6 & 0b00000001) == 0b1:
-				flashString.append("Red eye reduction supported.")		
-
-			if (value >> 5 & 0b00000001) == 0b1:
-				flashString = [("No flash function.")]
-		
-			for line in flashString:
-				comments.append(line)
-			
-			# value in bin
-			value = bin(value)
-
-		# Subject location
-		elif (tag == 37396):
-			comments.append("Main subject of the photo in X: %s and Y: %s"%(value[0], value[1]))
-			
-			if (len(value) == 3):
-				comments.append("Main subject in a circle of diameter %s"%(value[2]))
-			elif (len(value) == 4):
-				comments.append("Main subject in a rectangle of width %s and height %s"%(value[2], value[3]))
-				
-		# Maker Note
-		# (will be printed as hex data)
-		elif (tag == 37500):
-			
-			for line in string.split(self.dumpHex(value, length=16), '\n'):
-				if (len(line) > 0):
-					comments.append(line)
-			
-			# clear value
-			value = ""					
-		
-		# UserComment
-		elif (tag == 37510):
-			for line in string.split(self.dumpHex(value, length=16), '\n'):
-				if (len(line) > 0):
-					comments.append(line)
-
-		#Color Space
-		elif (tag == 40961):
-			if (value == 1):
-				comments.append("sRGB")
-			else:
-				comments.append("Uncalibrated")
+		decoder = tagDecoders.get(tag)
+		if (decoder != None):
+			(value, comments) = decoder(self, value)
 
-		# Sensing Method
-		elif (tag == 41495):
-		
-			values = {
-				1: "Not defined",
-				2: "One-chip color area sensor",
-				3: "Two-chip color area sensor",
-				4: "Three-chip color area sensor",
-				5: "Color sequential area sensor",
-				6: "Trilinear sensor",
-				7: "Color sequential linear"				
-			}
-			
-			if (value in values):
-				comments.append(values[value])
-			else:
-				comments.append("Value unknown.")
-		
-		# File Source
-		elif (tag == 41728):
-		
-			values = {
-				3: "Digital Still Camera"
-			}
-			
-			if (ord(value) in values):
-				comments.append(values[ord(value)])
-			else:
-				comments.append("Value unknown")
-			
-			value = self.stringHex(value)
-		
-		# Scene Type
-		elif (tag == 41729):
-			
-			values = {
-				1: "A directly photographed image"	
-			}
-			
-			if (ord(value) in values):
-				comments.append(values[ord(value)])
-			else:
-				comments.append("Value unknown")
-					
-			value = self.stringHex(value)
-		
-		# CFA Pattern
-		elif (tag == 41730):
-		
-			if (len(value) >= 4):
-				horRep = (ord(value[0]) * 16) + ord(value[1])
-				verRep = (ord(value[2]) * 16) + ord(value[3])
-				comments.append("Horizontal repeat pixel unit: %i"%horRep)
-				comments.append("Vertical repeat pixel unit: %i"%verRep)
-			
-			values = {
-				0: "RED",
-				1: "GRE",
-				2: "BLU",
-				3: "CYA",
-				4: "MAG",
-				5: "YEL",
-				6: "WHI"
-			}
-			
-			pos = 0
-			row = ""
-			for char in value[4:]:
-				pos += 1
-				if (ord(char) in values):
-					row = "%s%s "%(row,values[ord(char)])
-				else:
-					row += "??? "
-				if (pos >= verRep):
-					comments.append(row)
-					row = ""
-					pos = 0
-				
-			value = self.stringHex(value)
-		
 		# Other tags
 		else:
+			comments = []
 			if (isinstance(value, tuple)):
 				if (len(value) == 2):
 					value = "%.4f"%self._rational_to_num(value)
-			
-			if (tag in []):
-				value = self.stringHex(value)		
-	
+
+		# UNDEFINED values left as they are (memoryviews)
+		value = bytesOf(value)
+
 		# Building return array
 		ret = {}
 		ret['tag'] = tag
@@ -572,58 +1013,378 @@ class ExifData():
 		comments = analyzedTag['comments']
 		
 		# Building return string
-		returnString = "%s\t%s: %s"%(tag, decoded, value)
+		lines = ["%s\t%s: %s"%(tag, decoded, value)]
 		for line in comments:	
-			returnString += "\n\t%s"%line
-		
-		return returnString
-	
-	def printExifs(self):
+			lines.append("\t%s"%line)
 		
-		print("\nAnalyzing file: \"%s\"\n"%self.filename)
+		return "\n".join(lines)
 	
-		print "Image format: %s"%self.imageFormat
-		print "Image mode: %s"%self.imageMode
-		print "Image size: %s"%self.imageSize
+	# yields the lines of the text printed by printExifs(), one tag at a
+	# time
+	def iterText(self):
 
-		print("\nList of EXIF tags:\n")
-		for element in self.exifs:
-			print(self.exifToString(element).strip('\n'))
-			  
-		print("\nFound %i tags.\n"%len(self.exifs))
+		yield "\nAnalyzing file: \"%s\"\n"%self.filename
+
+		yield "Image format: %s"%self.imageFormat
+		yield "Image mode: %s"%self.imageMode
+		yield "Image size: %s"%self.imageSize
 
-	def getExifs(self):
-		ret = []
+		yield "\nList of EXIF tags:\n"
 		for element in self.exifs:
-			ret.append(self.exifToArray(element))
-		return ret
+			yield self.exifToString(element).strip('\n')
+
+		yield "\nFound %i tags.\n"%len(self.exifs)
+
+	# the text printed by printExifs()
+	def formatExifs(self):
+		return "\n".join(self.iterText())
+
+	def printExifs(self, out=None):
+		if (out == None):
+			out = sys.stdout
+		for line in self.iterText():
+			out.write(line + "\n")
+
+	# yields one record (dictionary) for each tag: file, tag, ifd, name,
+	# value and comments (a list), the texts as unicode; nothing is kept,
+	# a tag is interpreted when its record is asked for
+	def iterRecords(self, tags=None, ifds=None):
+		for element in self.selectExifs(tags, ifds):
+			analyzed = self.exifToArray(element)
+			yield {
+				'file': recordText(self.filename),
+				'tag': analyzed['tag'],
+				'ifd': element.ifd,
+				'name': recordText(analyzed['decoded']),
+				'value': recordText(analyzed['value']),
+				'comments': [recordText(comment) for comment in analyzed['comments']]
+			}
+
+	# the elements of self.exifs with the given tags (numbers or
+	# descriptions) and in the given ifds ("IFD0", "Exif", "GPS"), all of
+	# them if None
+	def selectExifs(self, tags=None, ifds=None):
+
+		elements = self.exifs
+		if (tags != None):
+			wanted = []
+			for tag in tags:
+				if (isinstance(tag, int)):
+					wanted.extend(self.searchExifKeyAll(tag))
+				else:
+					wanted.extend(self.searchExifNameAll(tag))
+			wanted = set(wanted)
+			elements = [element for element in elements if element in wanted]
+		if (ifds != None):
+			elements = [element for element in elements if element.ifd in ifds]
+
+		return elements
+
+	# the tags interpreted by exifToArray(), as a list-like ExifView: each
+	# tag is interpreted when first read. tags and ifds restrict the view
+	# as in selectExifs()
+	def getExifs(self, tags=None, ifds=None):
+		return ExifView(self, self.selectExifs(tags, ifds))
+
+# the result of ExifData.getExifs(): a read-only list of the dictionaries
+# returned by exifToArray(), built on first access and then kept
+class ExifView():
+
+	def __init__(self, exifData, elements):
+		self.exifData = exifData
+		self.elements = elements
+		self.interpreted = [None] * len(elements)
+
+	def __len__(self):
+		return len(self.elements)
+
+	def __getitem__(self, index):
+		if (isinstance(index, slice)):
+			return [self[i] for i in range(*index.indices(len(self.elements)))]
+		if (index < 0):
+			index += len(self.elements)
+		if (self.interpreted[index] == None):
+			self.interpreted[index] = self.exifData.exifToArray(self.elements[index])
+		return self.interpreted[index]
+
+	def __iter__(self):
+		interpreted = self.interpreted
+		for i in range(len(self.elements)):
+			if (interpreted[i] == None):
+				interpreted[i] = self.exifData.exifToArray(self.elements[i])
+			yield interpreted[i]
+
+	# interpreted tag with number (or description) tag, or None
+	def tag(self, tag):
+		for i in range(len(self.elements)):
+			if (self.elements[i][0] == tag or self.elements[i][1] == tag):
+				return self[i]
+		return None
+
+# ------- Structured output --------------------------------------------------
+
+# output formats of the command line tool: the text of printExifs(), or
+# one record per tag (see ExifData.iterRecords) as JSON Lines, CSV or TSV
+outputFormats = ['text', 'jsonl', 'csv', 'tsv']
+
+# columns of the CSV and TSV formats
+recordFields = ['file', 'tag', 'ifd', 'name', 'value', 'comments']
+
+# values and comments as unicode; byte strings are read as UTF-8
+# (invalid bytes replaced)
+def recordText(value):
+	if (isinstance(value, unicode)):
+		return value
+	return ("%s"%(value,)).decode("utf-8", "replace")
+
+# TSV fields: tabs, newlines and backslashes escaped (as read by
+# PostgreSQL COPY and most loaders)
+def tsvField(text):
+	return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+# the header line of format, or None
+def recordHeader(format):
+	if (format == 'csv'):
+		return ",".join(recordFields)
+	if (format == 'tsv'):
+		return "\t".join(recordFields)
+	return None
+
+# one record as a line (UTF-8, without the line end) in format; in CSV
+# and TSV the comments are joined by "; "
+def formatRecord(record, format):
+
+	if (format == 'jsonl'):
+		import json
+		return json.dumps(record, sort_keys=True)
+
+	fields = []
+	for field in recordFields:
+		value = record[field]
+		if (field == 'comments'):
+			value = u"; ".join(value)
+		fields.append(recordText(value).encode("utf-8"))
+
+	if (format == 'tsv'):
+		return "\t".join([tsvField(field) for field in fields])
+
+	import csv, cStringIO
+	buffer = cStringIO.StringIO()
+	csv.writer(buffer, lineterminator="").writerow(fields)
+	return buffer.getvalue()
+
+# yields the output lines of exifData in format (without header)
+def iterOutput(exifData, format):
+	if (format == 'text'):
+		for line in exifData.iterText():
+			yield line
+	else:
+		for record in exifData.iterRecords():
+			yield formatRecord(record, format)
+
+# ------- Multi-file mode ----------------------------------------------------
+
+# extensions picked up when scanning a directory
+scanExtensions = ['.jpg', '.jpeg', '.jpe', '.tif', '.tiff']
+
+# yields the files to analyze, in order: the given files, the images in
+# the given directories (recursively, sorted), the files listed in
+# listFiles (one per line, "-" for stdin)
+def iterInputs(paths, listFiles=[]):
+
+	for path in paths:
+		if (os.path.isdir(path)):
+			for root, subDirs, files in os.walk(path):
+				subDirs.sort()
+				for file in sorted(files):
+					if (os.path.splitext(file)[1].lower() in scanExtensions):
+						yield os.path.join(root, file)
+		else:
+			yield path
+
+	for listFile in listFiles:
+		if (listFile == "-"):
+			f = sys.stdin
+		else:
+			f = open(listFile, "r")
+		for line in f:
+			line = line.strip()
+			if (len(line) > 0):
+				yield line
+		if (f != sys.stdin):
+			f.close()
+
+# one ExifData for each worker process, reused for all its files, and
+# the output format (set by initWorker)
+workerExifData = None
+workerFormat = 'text'
+
+def initWorker(format):
+	global workerFormat
+	workerFormat = format
+
+# runs in the worker processes; returns (filename, output or None). An
+# error in a file (a decoder failing on a broken tag...) fails that file
+# only, not the whole run
+def analyzeFile(filename):
+	global workerExifData
+	if (workerExifData == None):
+		workerExifData = ExifData()
+	try:
+		if (workerExifData.openFile(filename) != 0):
+			return (filename, None)
+		return (filename, "\n".join(iterOutput(workerExifData, workerFormat)))
+	except Exception:
+		getLogger().error("Error while analyzing input file.")
+		getLogger().debug("Error: %s"%sys.exc_info()[1])
+		return (filename, None)
 
 if __name__ == "__main__":
 
+	import getopt
+
 	def usage():
 		print("")
 		print("PicciMario EXIF analyzer v. 0.1")
 		print("mario.piccinelli@gmail.com")
 		print("")
 		print("Usage:")
-		print("exifviewer.py filename")
+		print("exifviewer.py [-j workers] [-l listfile] [-f format] [-c cachefile] file|directory ...")
 		print("")
-	
-	filename = ""
-	
-	if (len(sys.argv) <= 1):
+		print(" directories are scanned recursively for JPG and TIFF images")
+		print(" -f   output format: %s (default: text); jsonl, csv and tsv"%", ".join(outputFormats))
+		print("      give one record per tag: file, tag, ifd, name, value, comments")
+		print(" -c   metadata cache (SQLite file, created if missing): the files not")
+		print("      changed (size, mtime, inode) since the last run are not read")
+		print(" -l   file with one file name per line (\"-\" for stdin), can be repeated")
+		print(" -j   number of worker processes when analyzing more than one file")
+		print("      (default: number of CPUs); the output keeps the input order")
+		print("")
+
+	try:
+		opts, args = getopt.gnu_getopt(sys.argv[1:], "hj:l:f:c:")
+	except getopt.GetoptError:
 		usage()
 		sys.exit(1)
-	else:
-		filename = sys.argv[1]
-	
-	# init exif data manager
-	
-	exifs = ExifData()
-	result = exifs.openFile(filename)
-	
-	if (result != 0):
-		print("Unable to init data file")
+
+	workers = None
+	listFiles = []
+	format = 'text'
+	for o,a in opts:
+		if o == "-h":
+			usage()
+			sys.exit(0)
+		elif o == "-f":
+			if (a not in outputFormats):
+				usage()
+				print("Unknown output format: \"%s\".\n"%a)
+				sys.exit(1)
+			format = a
+		elif o == "-c":
+			from metacache import MetaCache
+			try:
+				# the workers inherit it
+				metaCache = MetaCache(a)
+			except Exception, e:
+				print("Unable to use metadata cache \"%s\": %s\n"%(a, e))
+				sys.exit(1)
+		elif o == "-l":
+			listFiles.append(a)
+		elif o == "-j":
+			try:
+				workers = max(1, int(a))
+			except ValueError:
+				usage()
+				print("Invalid number of workers: \"%s\".\n"%a)
+				sys.exit(1)
+
+	if (len(args) == 0 and len(listFiles) == 0):
+		usage()
+		sys.exit(1)
+
+	# errors go to stderr with the structured formats, not to mix with
+	# the records
+	def failure(message):
+		if (format == 'text'):
+			print(message)
+		else:
+			sys.stderr.write(message.strip("\n") + "\n")
+
+	# the output is written through the (buffered) sys.stdout; a closed
+	# pipe (| head) ends the program quietly
+	out = sys.stdout
+
+	def isClosedPipe(error):
+		import errno
+		return (error.errno == errno.EPIPE)
+
+	# what is left in the buffer goes nowhere. With a pool, its workers
+	# are only sent SIGTERM: pool.terminate() and join() can block on the
+	# handler threads of the pool, os._exit does not wait for them
+	def exitClosedPipe(pool=None):
+		os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
+		if (pool != None):
+			for worker in pool._pool:
+				worker.terminate()
+		os._exit(0)
+
+	try:
+		header = recordHeader(format)
+		if (header != None):
+			out.write(header + "\n")
+
+		# single file: no pool
+		if (len(args) == 1 and len(listFiles) == 0 and os.path.isdir(args[0]) == False):
+
+			# init exif data manager
+
+			exifs = ExifData()
+			result = exifs.openFile(args[0])
+
+			if (result != 0):
+				failure("Unable to init data file")
+				sys.exit(1)
+
+			for line in iterOutput(exifs, format):
+				out.write(line + "\n")
+			sys.exit(0)
+
+		import multiprocessing
+
+		if (workers == None):
+			workers = multiprocessing.cpu_count()
+
+		failed = 0
+		pool = multiprocessing.Pool(workers, initWorker, (format,))
+		try:
+			# imap returns the results in input order, as soon as each one
+			# (and the ones before it) is ready
+			for (filename, output) in pool.imap(analyzeFile, iterInputs(args, listFiles), 16):
+				if (output == None):
+					failure("\nUnable to init data file \"%s\"\n"%filename)
+					failed += 1
+				elif (len(output) > 0):
+					out.write(output + "\n")
+			pool.close()
+		except KeyboardInterrupt:
+			pool.terminate()
+			sys.exit(1)
+		except IOError, e:
+			if (isClosedPipe(e)):
+				exitClosedPipe(pool)
+			pool.terminate()
+			raise
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+
+		out.flush()
+	except IOError, e:
+		if (isClosedPipe(e) == False):
+			raise
+		exitClosedPipe()
+
+	if (failed > 0):
 		sys.exit(1)
-	
-	exifs.printExifs()
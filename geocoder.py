@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+"""
+Offline reverse geocoder
+(part of ExifViewer project - https://github.com/PicciMario/EXIF-Viewer)
+Copyright (c) 2011 PicciMario <mario.piccinelli@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import sys, math, mmap, struct, time
+
+# Index file layout (little endian):
+#
+#   header    magic, cell size (degrees), number of points, grid rows, grid columns
+#   cells     (rows * columns + 1) uint32, index of the first point of each
+#             cell; the points of a cell are between cells[i] and cells[i+1]
+#   points    float32 lat, float32 lon, uint32 offset of the place name
+#   names     utf-8 place names, each terminated by "\0"
+#
+# The grid is an equirectangular lat/lon grid, cell 0 is at -90/-180.
+
+indexMagic = "EXGEO001"
+headerFormat = "<8sdIII"
+headerSize = struct.calcsize(headerFormat)
+pointFormat = "<ffI"
+pointSize = struct.calcsize(pointFormat)
+
+# default grid cell size (degrees)
+defaultCellSize = 0.5
+
+# places farther than this are not reported (km)
+maxDistance = 100.0
+
+earthRadius = 6371.0
+
+def distanceKm(lat1, lon1, lat2, lon2):
+	lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+	a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+	return 2 * earthRadius * math.asin(min(1.0, math.sqrt(a)))
+
+def _gridSize(cellSize):
+	return (int(math.ceil(180.0 / cellSize)), int(math.ceil(360.0 / cellSize)))
+
+def _cell(lat, lon, cellSize, rows, cols):
+	row = min(rows - 1, max(0, int((lat + 90.0) / cellSize)))
+	col = int((lon + 180.0) / cellSize) % cols
+	return (row, col)
+
+class LocalGeocoder():
+
+	# reverse geocoding on a place index built by buildIndex(); the index
+	# file is memory-mapped, so opening it costs nothing and the pages
+	# are shared by all the processes using it
+
+	def __init__(self, indexFile):
+
+		self.indexFile = indexFile
+
+		f = open(indexFile, "rb")
+		try:
+			self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			f.close()
+
+		(magic, self.cellSize, self.numPoints, self.rows, self.cols) = struct.unpack_from(headerFormat, self.data, 0)
+		if (magic != indexMagic):
+			raise ValueError("\"%s\" is not a reverse geocoding index"%indexFile)
+
+		self.cellsOffset = headerSize
+		self.pointsOffset = self.cellsOffset + (self.rows * self.cols + 1) * 4
+		self.namesOffset = self.pointsOffset + self.numPoints * pointSize
+
+	def close(self):
+		self.data.close()
+
+	def _cellPoints(self, row, col):
+		cell = row * self.cols + col
+		(first, last) = struct.unpack_from("<II", self.data, self.cellsOffset + cell * 4)
+		for i in xrange(first, last):
+			yield struct.unpack_from(pointFormat, self.data, self.pointsOffset + i * pointSize)
+
+	def _name(self, offset):
+		start = self.namesOffset + offset
+		end = self.data.find("\0", start)
+		return self.data[start:end].decode("utf-8")
+
+	# returns (place name, distance in km) of the nearest place, or None
+	def lookup(self, lat, lon, maxDistance=maxDistance):
+
+		(row, col) = _cell(lat, lon, self.cellSize, self.rows, self.cols)
+
+		best = None
+		bestDistance = maxDistance
+
+		# look at the cells in rings of growing radius around the point,
+		# until no cell of the next ring can hold anything nearer. A cell
+		# k rows away is at least (k - 1) cells of latitude away; a cell k
+		# columns away at least as far as the meridian (k - 1) cells of
+		# longitude away, whatever its latitude
+		cellKm = math.radians(self.cellSize) * earthRadius
+		cosLat = math.cos(math.radians(lat))
+
+		def rowBound(rows):
+			return max(0, rows - 1) * cellKm
+
+		def colBound(cols):
+			degrees = min(90.0, max(0, cols - 1) * self.cellSize)
+			return earthRadius * math.asin(min(1.0, cosLat * math.sin(math.radians(degrees))))
+
+		ring = 0
+		while True:
+
+			# rows near enough (the others only get farther)
+			band = int(bestDistance / cellKm) + 1
+			for r in range(max(0, row - min(ring, band)), min(self.rows, row + min(ring, band) + 1)):
+				# only the border of the ring (the inside is done)
+				if (abs(r - row) == ring):
+					cols = range(col - ring, col + ring + 1)
+				else:
+					cols = [col - ring, col + ring]
+				for c in cols:
+					if (max(rowBound(abs(r - row)), colBound(abs(c - col))) >= bestDistance):
+						continue
+					for (pLat, pLon, nameOffset) in self._cellPoints(r, c % self.cols):
+						distance = distanceKm(lat, lon, pLat, pLon)
+						if (distance < bestDistance):
+							best = nameOffset
+							bestDistance = distance
+
+			# nearest possible point of the next ring: its rows above and
+			# below (if inside the grid), or its columns left and right
+			# (if not all the columns are done)
+			ring += 1
+			bound = None
+			if (row - ring >= 0 or row + ring < self.rows):
+				bound = rowBound(ring)
+			if (2 * ring - 1 < self.cols):
+				if (bound == None or colBound(ring) < bound):
+					bound = colBound(ring)
+			if (bound == None or bound >= bestDistance):
+				break
+
+		if (best == None):
+			return None
+		return (self._name(best), bestDistance)
+
+# ------- Index Build -----------------------------------------------------
+
+# reads admin1CodesASCII.txt (GeoNames): "CC.code" -> region name
+def readAdmin1Names(admin1File):
+	names = {}
+	f = open(admin1File, "r")
+	for line in f:
+		fields = line.rstrip("\n").split("\t")
+		if (len(fields) >= 2):
+			names[fields[0]] = fields[1]
+	f.close()
+	return names
+
+# builds an index file from a GeoNames dump (allCountries.txt,
+# citiesNNNN.txt, or a country file); only populated places (feature
+# class P) are kept unless featureClasses says otherwise
+def buildIndex(geonamesFile, indexFile, admin1File=None, cellSize=defaultCellSize, featureClasses="P"):
+
+	admin1Names = {}
+	if (admin1File != None):
+		admin1Names = readAdmin1Names(admin1File)
+
+	(rows, cols) = _gridSize(cellSize)
+
+	# (cell, lat, lon, name)
+	places = []
+
+	f = open(geonamesFile, "r")
+	for line in f:
+		fields = line.rstrip("\n").split("\t")
+		if (len(fields) < 11):
+			continue
+		if (len(featureClasses) > 0 and fields[6] not in featureClasses):
+			continue
+		try:
+			lat = float(fields[4])
+			lon = float(fields[5])
+		except ValueError:
+			continue
+
+		name = fields[1]
+		region = admin1Names.get("%s.%s"%(fields[8], fields[10]))
+		if (region != None and region != name):
+			name = "%s, %s"%(name, region)
+		if (len(fields[8]) > 0):
+			name = "%s (%s)"%(name, fields[8])
+
+		(row, col) = _cell(lat, lon, cellSize, rows, cols)
+		places.append((row * cols + col, lat, lon, name))
+	f.close()
+
+	places.sort()
+
+	names = []
+	namesSize = 0
+	points = []
+	cells = [0] * (rows * cols + 1)
+	for (cell, lat, lon, name) in places:
+		cells[cell + 1] += 1
+		points.append(struct.pack(pointFormat, lat, lon, namesSize))
+		name = name.replace("\0", "") + "\0"
+		names.append(name)
+		namesSize += len(name)
+
+	# counts to offsets
+	for i in range(1, len(cells)):
+		cells[i] += cells[i - 1]
+
+	out = open(indexFile, "wb")
+	out.write(struct.pack(headerFormat, indexMagic, cellSize, len(places), rows, cols))
+	out.write(struct.pack("<%iI"%len(cells), *cells))
+	out.write("".join(points))
+	out.write("".join(names))
+	out.close()
+
+	return len(places)
+
+if __name__ == "__main__":
+
+	def usage():
+		print("")
+		print("PicciMario EXIF analyzer v. 0.1 - offline reverse geocoder")
+		print("mario.piccinelli@gmail.com")
+		print("")
+		print("Usage:")
+		print("geocoder.py build geonames.txt index.geo [admin1CodesASCII.txt]")
+		print("  builds the index used by exif2reporter.py --geocoder from a GeoNames")
+		print("  dump (http://download.geonames.org/export/dump/)")
+		print("geocoder.py lookup index.geo lat lon")
+		print("")
+
+	if (len(sys.argv) >= 4 and sys.argv[1] == "build"):
+		admin1File = None
+		if (len(sys.argv) > 4):
+			admin1File = sys.argv[4]
+		start = time.time()
+		count = buildIndex(sys.argv[2], sys.argv[3], admin1File)
+		print("Indexed %i places in %.2fs"%(count, time.time() - start))
+
+	elif (len(sys.argv) == 5 and sys.argv[1] == "lookup"):
+		start = time.time()
+		geocoder = LocalGeocoder(sys.argv[2])
+		result = geocoder.lookup(float(sys.argv[3]), float(sys.argv[4]))
+		elapsed = time.time() - start
+		if (result == None):
+			print("No place found within %i km"%maxDistance)
+		else:
+			print("%s - %.1f km (%.3f ms)"%(result[0].encode("utf-8"), result[1], elapsed * 1000))
+
+	else:
+		usage()
+		sys.exit(1)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+Metadata cache
+(part of ExifViewer project - https://github.com/PicciMario/EXIF-Viewer)
+Copyright (c) 2011 PicciMario <mario.piccinelli@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import sys, os, time, sqlite3, cPickle
+
+# Cache file layout (SQLite):
+#
+#   entries   kind, path (absolute), size, mtime, inode, data
+#
+# kind tells the users of the cache apart (the exifviewer.py tags and the
+# exiv2 tags of exif2reporter.py are both kept for the same file), and
+# carries their version: a new kind leaves the old entries unused. data
+# is pickled. An entry is valid while size, mtime and inode of the file
+# are the ones it was saved with.
+
+schema = """
+CREATE TABLE IF NOT EXISTS entries (
+	kind TEXT NOT NULL,
+	path TEXT NOT NULL,
+	size INTEGER NOT NULL,
+	mtime REAL NOT NULL,
+	inode INTEGER NOT NULL,
+	data BLOB NOT NULL,
+	PRIMARY KEY (kind, path)
+)
+"""
+
+# seconds to wait for another process writing the cache
+lockTimeout = 30
+
+# (absolute path, size, mtime, inode) of a file, or None if it can not be
+# read
+def fileKey(path):
+	try:
+		stats = os.stat(path)
+	except OSError:
+		return None
+	return (os.path.abspath(path), stats.st_size, stats.st_mtime, stats.st_ino)
+
+class MetaCache():
+
+	# the connection is opened on first use in each process, so a cache
+	# created before a multiprocessing pool can be used by its workers;
+	# the database is in WAL mode, readers do not wait for the writers
+
+	def __init__(self, cacheFile):
+
+		self.cacheFile = cacheFile
+		self.db = None
+		self.pid = None
+
+		# counters (for this process)
+		self.hits = 0
+		self.misses = 0
+
+		# fails here, not in the workers, if the file can not be created
+		self._connect()
+
+	def _connect(self):
+		if (self.db == None or self.pid != os.getpid()):
+			self.db = sqlite3.connect(self.cacheFile, timeout=lockTimeout, isolation_level=None)
+			self.db.text_factory = str
+			self.db.execute("PRAGMA journal_mode=WAL")
+			self.db.execute("PRAGMA synchronous=NORMAL")
+			self.db.execute(schema)
+			self.pid = os.getpid()
+		return self.db
+
+	def close(self):
+		if (self.db != None):
+			self.db.close()
+			self.db = None
+
+	# returns (key, data): key is the fileKey() of path (None if the file
+	# can not be read), data what was saved for it with store(), or None
+	# if missing or saved for another version of the file
+	def lookup(self, kind, path):
+
+		key = fileKey(path)
+		if (key == None):
+			self.misses += 1
+			return (None, None)
+
+		try:
+			row = self._connect().execute(
+				"SELECT size, mtime, inode, data FROM entries WHERE kind=? AND path=?",
+				(kind, key[0])
+			).fetchone()
+		except sqlite3.Error, e:
+			sys.stderr.write("Unable to read the metadata cache \"%s\": %s\n"%(self.cacheFile, e))
+			row = None
+
+		if (row == None or tuple(row[:3]) != key[1:]):
+			self.misses += 1
+			return (key, None)
+
+		try:
+			data = cPickle.loads(str(row[3]))
+		except:
+			self.misses += 1
+			return (key, None)
+
+		self.hits += 1
+		return (key, data)
+
+	# saves data for the file of key (as returned by lookup(), taken before
+	# reading the file: if the file changes meanwhile the entry is not
+	# valid on the next lookup)
+	def store(self, kind, key, data):
+
+		if (key == None):
+			return
+
+		try:
+			self._connect().execute(
+				"INSERT OR REPLACE INTO entries (kind, path, size, mtime, inode, data) VALUES (?, ?, ?, ?, ?, ?)",
+				(kind, key[0], key[1], key[2], key[3], sqlite3.Binary(cPickle.dumps(data, 2)))
+			)
+		except sqlite3.Error, e:
+			sys.stderr.write("Unable to save \"%s\" in the metadata cache \"%s\": %s\n"%(key[0], self.cacheFile, e))
+
+	# removes the entries of the files that changed or do not exist
+	# anymore; returns the number of entries removed
+	def prune(self):
+
+		db = self._connect()
+		stale = []
+		for (kind, path, size, mtime, inode) in db.execute("SELECT kind, path, size, mtime, inode FROM entries"):
+			key = fileKey(path)
+			if (key == None or key[1:] != (size, mtime, inode)):
+				stale.append((kind, path))
+
+		db.execute("BEGIN")
+		db.executemany("DELETE FROM entries WHERE kind=? AND path=?", stale)
+		db.execute("COMMIT")
+		db.execute("VACUUM")
+		return len(stale)
+
+	# number of entries by kind
+	def info(self):
+		return self._connect().execute("SELECT kind, COUNT(*) FROM entries GROUP BY kind ORDER BY kind").fetchall()
+
+if __name__ == "__main__":
+
+	def usage():
+		print("")
+		print("PicciMario EXIF analyzer v. 0.1 - metadata cache")
+		print("mario.piccinelli@gmail.com")
+		print("")
+		print("Usage:")
+		print("metacache.py info cachefile")
+		print("  number of files in the cache used by exifviewer.py -c and")
+		print("  exif2reporter.py --meta-cache")
+		print("metacache.py prune cachefile")
+		print("  removes the entries of the files changed or removed since")
+		print("")
+
+	if (len(sys.argv) != 3 or sys.argv[1] not in ["info", "prune"]):
+		usage()
+		sys.exit(1)
+
+	if (os.path.isfile(sys.argv[2]) == False):
+		print("Cache \"%s\" not found"%sys.argv[2])
+		sys.exit(1)
+
+	cache = MetaCache(sys.argv[2])
+	if (sys.argv[1] == "info"):
+		for (kind, count) in cache.info():
+			print("%s: %i files"%(kind, count))
+		print("Cache \"%s\": %i kB"%(cache.cacheFile, os.path.getsize(cache.cacheFile)/1024))
+	else:
+		start = time.time()
+		count = cache.prune()
+		print("Removed %i entries in %.2fs"%(count, time.time() - start))
@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+
+"""
+EXIF reporter server
+(part of ExifViewer project - https://github.com/PicciMario/EXIF-Viewer)
+Copyright (c) 2011 PicciMario <mario.piccinelli@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+# Various dependencies
+import sys, os, time, getopt, json, urlparse
+
+# HTTP server, one thread per connection
+import BaseHTTPServer, SocketServer
+
+# Job queue and dispatcher threads
+import threading, Queue
+
+# Process pool
+import multiprocessing
+
+# The reporter (ReportLab and the style sheets are loaded once, by main(),
+# and inherited by the worker processes)
+import exif2reporter
+from exif2reporter import Reporter
+from tilecache import TileCache
+from geocoder import LocalGeocoder
+from metacache import MetaCache
+
+# finished jobs kept for GET /jobs/<id> (status only: the job arguments,
+# with the uploaded image, are dropped when the report is done, and the
+# PDF of POST /report when it is sent)
+finishedJobsKept = 1000
+
+# longest image accepted by POST /report (bytes)
+maxUploadSize = 100 * 1024 * 1024
+
+def usage():
+	print("")
+	print("PicciMario EXIF reporter server v. 0.1")
+	print("mario.piccinelli@gmail.com")
+	print("")
+	print("Keeps the reporter loaded and builds the reports requested over HTTP,")
+	print("with a pool of worker processes.")
+	print("")
+	print("Usage:")
+	print("reportserver.py [-b address] [-p port] [-j workers] [-q queuesize] [-i inputdir -o outputdir]")
+	print("")
+	print(" -b   address to listen on (default: 127.0.0.1)")
+	print(" -p   port to listen on (default: 8642)")
+	print(" -j   number of worker processes (default: number of CPUs)")
+	print(" -q   max number of jobs waiting in the queue (default: 100)")
+	print(" -t   parent directory for the temporary workspace of each report")
+	print(" -i   directory of the input files of POST /jobs")
+	print(" -o   directory of the reports of POST /jobs (POST /jobs is disabled")
+	print("      without -i and -o)")
+	print(" --tile-cache=dir, --tile-cache-size=MB, --offline, --geocoder=index,")
+	print(" --map-timeout=seconds, --meta-cache=file: as in exif2reporter.py")
+	print("")
+	print("Requests:")
+	print(" POST /jobs       {\"input\": \"photo.jpg\", \"output\": \"report.pdf\"}, returns the job id;")
+	print("                  paths relative to the -i and -o directories")
+	print(" GET  /jobs/<id>  status of a job")
+	print(" POST /report     image data in the body (?name=photo.jpg), returns the PDF")
+	print(" GET  /health     queue and workers status")
+	print(" GET  /metrics    counters, in the Prometheus text format")
+	print("")
+
+# ------- Workers -----------------------------------------------------------
+
+# one Reporter for each worker process
+reporter = None
+
+# settings of the Reporters (tileCache, offline), set by main() before the
+# workers are forked
+reporterSettings = {}
+
+def workerReporter(tempDir):
+	global reporter
+	if (reporter == None):
+		reporter = Reporter(tempDir=tempDir, **reporterSettings)
+	return reporter
+
+# runs in the worker processes; returns (PDF data or None, error or None)
+def fileWorker(filename, reportFileName, tempDir):
+	try:
+		workerReporter(tempDir).report(filename, reportFileName)
+		return (None, None)
+	except Exception, e:
+		return (None, "%s"%e or e.__class__.__name__)
+
+def dataWorker(data, name, tempDir):
+	try:
+		return (workerReporter(tempDir).reportData(data, name), None)
+	except Exception, e:
+		return (None, "%s"%e or e.__class__.__name__)
+
+# ------- Jobs --------------------------------------------------------------
+
+class ReportServer():
+
+	# jobs are queued (up to queueSize waiting jobs) and handed to the
+	# pool by one dispatcher thread per worker process
+
+	def __init__(self, workers, queueSize, tempDir=None):
+
+		self.workers = workers
+		self.queueSize = queueSize
+		self.tempDir = tempDir
+		self.started = time.time()
+
+		self.queue = Queue.Queue(queueSize)
+		self.lock = threading.Lock()
+		self.jobs = {}
+		self.finished = []
+		self.nextId = 1
+
+		# counters
+		self.running = 0
+		self.completed = 0
+		self.failed = 0
+		self.rejected = 0
+		self.reportSeconds = 0.0
+		self.waitSeconds = 0.0
+
+		self.pool = multiprocessing.Pool(workers)
+
+		for i in range(workers):
+			thread = threading.Thread(target=self.dispatch)
+			thread.daemon = True
+			thread.start()
+
+	# queues a job; returns it, or None if the queue is full
+	def submit(self, kind, args):
+
+		# registered before it is queued, a dispatcher can take it at once
+		self.lock.acquire()
+		try:
+			job = {
+				'id': "%i"%self.nextId,
+				'kind': kind,
+				'args': args,
+				'status': 'queued',
+				'submitted': time.time(),
+				'elapsed': None,
+				'error': None,
+				'result': None,
+				'done': threading.Event(),
+			}
+			self.nextId += 1
+			self.jobs[job['id']] = job
+		finally:
+			self.lock.release()
+
+		try:
+			self.queue.put_nowait(job)
+		except Queue.Full:
+			self.lock.acquire()
+			self.jobs.pop(job['id'], None)
+			self.rejected += 1
+			self.lock.release()
+			return None
+
+		return job
+
+	# the PDF of a finished data job, removed from the job (it is sent
+	# once, only the status is kept)
+	def takeResult(self, job):
+		self.lock.acquire()
+		try:
+			result = job['result']
+			job['result'] = None
+			return result
+		finally:
+			self.lock.release()
+
+	def getJob(self, id):
+		self.lock.acquire()
+		try:
+			return self.jobs.get(id)
+		finally:
+			self.lock.release()
+
+	def dispatch(self):
+		while True:
+			job = self.queue.get()
+
+			self.lock.acquire()
+			job['status'] = 'running'
+			self.running += 1
+			self.waitSeconds += time.time() - job['submitted']
+			self.lock.release()
+
+			start = time.time()
+			if (job['kind'] == 'file'):
+				function = fileWorker
+			else:
+				function = dataWorker
+			try:
+				(result, error) = self.pool.apply(function, job['args'] + (self.tempDir,))
+			except Exception, e:
+				(result, error) = (None, "%s"%e or e.__class__.__name__)
+			elapsed = time.time() - start
+
+			self.lock.acquire()
+			# the uploaded image is not needed anymore
+			job['args'] = None
+			job['elapsed'] = elapsed
+			job['error'] = error
+			job['result'] = result
+			if (error == None):
+				job['status'] = 'done'
+				self.completed += 1
+			else:
+				job['status'] = 'failed'
+				self.failed += 1
+			self.running -= 1
+			self.reportSeconds += elapsed
+
+			# forget the oldest finished jobs
+			self.finished.append(job['id'])
+			while (len(self.finished) > finishedJobsKept):
+				self.jobs.pop(self.finished.pop(0), None)
+			self.lock.release()
+
+			job['done'].set()
+
+	def health(self):
+		self.lock.acquire()
+		try:
+			return {
+				'status': 'ok',
+				'workers': self.workers,
+				'running': self.running,
+				'queued': self.queue.qsize(),
+				'queueSize': self.queueSize,
+				'uptime': time.time() - self.started,
+			}
+		finally:
+			self.lock.release()
+
+	def metrics(self):
+		self.lock.acquire()
+		try:
+			lines = [
+				"# TYPE exif2reporter_reports_total counter",
+				"exif2reporter_reports_total{status=\"done\"} %i"%self.completed,
+				"exif2reporter_reports_total{status=\"failed\"} %i"%self.failed,
+				"# TYPE exif2reporter_rejected_total counter",
+				"exif2reporter_rejected_total %i"%self.rejected,
+				"# TYPE exif2reporter_report_seconds_sum counter",
+				"exif2reporter_report_seconds_sum %.6f"%self.reportSeconds,
+				"# TYPE exif2reporter_queue_wait_seconds_sum counter",
+				"exif2reporter_queue_wait_seconds_sum %.6f"%self.waitSeconds,
+				"# TYPE exif2reporter_queued gauge",
+				"exif2reporter_queued %i"%self.queue.qsize(),
+				"# TYPE exif2reporter_running gauge",
+				"exif2reporter_running %i"%self.running,
+				"# TYPE exif2reporter_workers gauge",
+				"exif2reporter_workers %i"%self.workers,
+				"# TYPE exif2reporter_uptime_seconds gauge",
+				"exif2reporter_uptime_seconds %.3f"%(time.time() - self.started),
+			]
+			return "\n".join(lines) + "\n"
+		finally:
+			self.lock.release()
+
+	def close(self):
+		self.pool.terminate()
+		self.pool.join()
+
+# ------- HTTP --------------------------------------------------------------
+
+# path (relative, from a request) in the directory root, as an absolute
+# path; None if it is not inside root (absolute paths, "..", symbolic
+# links pointing out of it)
+def pathInside(root, path):
+	if (root == None or len(path) == 0 or os.path.isabs(path)):
+		return None
+	root = os.path.realpath(root)
+	full = os.path.realpath(os.path.join(root, path))
+	if (full.startswith(root + os.sep) == False):
+		return None
+	return full
+
+def jobStatus(job):
+	return {
+		'id': job['id'],
+		'status': job['status'],
+		'elapsed': job['elapsed'],
+		'error': job['error'],
+	}
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+	# set by main()
+	reportServer = None
+	# directories of the input and output files of POST /jobs (the
+	# requests can not read or write files anywhere else)
+	inputDir = None
+	outputDir = None
+
+	def send(self, code, body, contentType="application/json"):
+		if (contentType == "application/json"):
+			body = json.dumps(body) + "\n"
+		self.send_response(code)
+		self.send_header("Content-Type", contentType)
+		self.send_header("Content-Length", "%i"%len(body))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def readBody(self):
+		try:
+			length = int(self.headers.getheader("Content-Length", "0"))
+		except ValueError:
+			length = -1
+		if (length < 0 or length > maxUploadSize):
+			return None
+		return self.rfile.read(length)
+
+	def do_GET(self):
+		path = urlparse.urlparse(self.path).path
+
+		if (path == "/health"):
+			self.send(200, self.reportServer.health())
+		elif (path == "/metrics"):
+			self.send(200, self.reportServer.metrics(), "text/plain; version=0.0.4")
+		elif (path.startswith("/jobs/")):
+			job = self.reportServer.getJob(path[len("/jobs/"):])
+			if (job == None):
+				self.send(404, {'error': "Unknown job"})
+			else:
+				self.send(200, jobStatus(job))
+		else:
+			self.send(404, {'error': "Not found"})
+
+	def do_POST(self):
+		url = urlparse.urlparse(self.path)
+
+		body = self.readBody()
+		if (body == None):
+			self.send(413, {'error': "Missing or too long request body"})
+			return
+
+		if (url.path == "/jobs"):
+			if (self.inputDir == None or self.outputDir == None):
+				self.send(403, {'error': "File jobs are disabled (no input and output dirs)"})
+				return
+
+			try:
+				request = json.loads(body)
+				(input, output) = (str(request['input']), str(request['output']))
+			except (ValueError, KeyError, TypeError):
+				self.send(400, {'error': "Expected {\"input\": file, \"output\": file}"})
+				return
+
+			args = (pathInside(self.inputDir, input), pathInside(self.outputDir, output))
+			if (None in args):
+				self.send(403, {'error': "Input and output must be relative paths inside the input and output dirs"})
+				return
+
+			job = self.reportServer.submit('file', args)
+			if (job == None):
+				self.send(503, {'error': "Queue full"})
+			else:
+				self.send(202, jobStatus(job))
+
+		elif (url.path == "/report"):
+			name = urlparse.parse_qs(url.query).get('name', ["image.jpg"])[0]
+
+			job = self.reportServer.submit('data', (body, name))
+			if (job == None):
+				self.send(503, {'error': "Queue full"})
+				return
+
+			job['done'].wait()
+			result = self.reportServer.takeResult(job)
+			if (job['error'] != None):
+				self.send(500, jobStatus(job))
+			else:
+				self.send(200, result, "application/pdf")
+
+		else:
+			self.send(404, {'error': "Not found"})
+
+	def log_message(self, format, *args):
+		print("%s - %s"%(self.address_string(), format%args))
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+# ------- Main ---------------------------------------------------------------
+
+def main():
+
+	address = "127.0.0.1"
+	port = 8642
+	workers = multiprocessing.cpu_count()
+	queueSize = 100
+	tempDir = None
+	tileCacheDir = None
+	tileCacheSize = 200
+	inputDir = None
+	outputDir = None
+
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "hb:p:j:q:t:i:o:", ["tile-cache=", "tile-cache-size=", "offline", "map-timeout=", "geocoder=", "meta-cache="])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(1)
+
+	try:
+		for o,a in opts:
+			if o == "-h":
+				usage()
+				sys.exit(0)
+			elif o == "-b":
+				address = a
+			elif o == "-p":
+				port = int(a)
+			elif o == "-j":
+				workers = max(1, int(a))
+			elif o == "-q":
+				queueSize = max(1, int(a))
+			elif o == "-t":
+				tempDir = a
+			elif o == "-i":
+				inputDir = a
+			elif o == "-o":
+				outputDir = a
+			elif o == "--tile-cache":
+				tileCacheDir = a
+			elif o == "--tile-cache-size":
+				tileCacheSize = int(a)
+			elif o == "--offline":
+				reporterSettings['offline'] = True
+			elif o == "--map-timeout":
+				exif2reporter.mapTimeout = float(a)
+			elif o == "--geocoder":
+				try:
+					exif2reporter.localGeocoder = LocalGeocoder(a)
+				except (IOError, ValueError), e:
+					print("Unable to open reverse geocoding index \"%s\": %s\n"%(a, e))
+					sys.exit(1)
+			elif o == "--meta-cache":
+				try:
+					exif2reporter.metaCache = MetaCache(a)
+				except Exception, e:
+					print("Unable to use metadata cache \"%s\": %s\n"%(a, e))
+					sys.exit(1)
+	except ValueError:
+		usage()
+		print("Invalid value for option %s: \"%s\".\n"%(o, a))
+		sys.exit(1)
+
+	for dir in [inputDir, outputDir]:
+		if (dir != None and os.path.isdir(dir) == False):
+			print("Directory not found: \"%s\"\n"%dir)
+			sys.exit(1)
+
+	if (tileCacheDir != None):
+		try:
+			reporterSettings['tileCache'] = TileCache(tileCacheDir, maxSize=tileCacheSize*1024*1024, offline=reporterSettings.get('offline', False))
+		except OSError, e:
+			print("Unable to use tiles cache \"%s\": %s\n"%(tileCacheDir, e))
+			sys.exit(1)
+
+	# the workers are forked now, with ReportLab loaded and the settings
+	# above
+	exif2reporter.loadReportLab()
+	reportServer = ReportServer(workers, queueSize, tempDir)
+	RequestHandler.reportServer = reportServer
+	RequestHandler.inputDir = inputDir
+	RequestHandler.outputDir = outputDir
+
+	try:
+		httpd = ThreadingHTTPServer((address, port), RequestHandler)
+	except Exception, e:
+		print("Unable to listen on %s:%i: %s\n"%(address, port, e))
+		reportServer.close()
+		sys.exit(1)
+
+	print("Listening on http://%s:%i/ with %i workers (queue size %i)"%(address, port, workers, queueSize))
+
+	try:
+		httpd.serve_forever()
+	except KeyboardInterrupt:
+		print("Shutting down...")
+	finally:
+		httpd.server_close()
+		reportServer.close()
+
+if __name__ == "__main__":
+	main()
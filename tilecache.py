@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+"""
+OpenStreetMap tile cache
+(part of ExifViewer project - https://github.com/PicciMario/EXIF-Viewer)
+Copyright (c) 2011 PicciMario <mario.piccinelli@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import sys, os, time, tempfile, sqlite3
+
+# where the tiles are downloaded from
+tileUrl = "http://tile.openstreetmap.org/%s/%s/%s.png"
+
+# timeout (seconds) of each tile download
+tileTimeout = 10
+
+class TileCache():
+
+	# tiles are saved in cacheDir as zoom/x/y.png (the same layout used by
+	# most tile servers, so a cache dir can be used as seed source too).
+	# The mtime of each file is its last use: when the cache grows over
+	# maxSize bytes the least recently used tiles are removed.
+	#
+	# seedSources: tile directories (zoom/x/y.png) or MBTiles files looked
+	# up, in order, before downloading a missing tile.
+	# offline: never download, only cached and seed tiles are available.
+
+	def __init__(self, cacheDir, maxSize=200*1024*1024, seedSources=[], offline=False):
+
+		self.cacheDir = cacheDir
+		self.maxSize = maxSize
+		self.seedSources = list(seedSources)
+		self.offline = offline
+
+		# counters (for this process)
+		self.hits = 0
+		self.seedHits = 0
+		self.downloads = 0
+		self.misses = 0
+
+		if (os.path.isdir(cacheDir) == False):
+			os.makedirs(cacheDir)
+
+		self.size = self._cacheSize()
+
+	def _tilePath(self, zoom, x, y):
+		return os.path.join(self.cacheDir, "%i"%zoom, "%i"%x, "%i.png"%y)
+
+	def _cacheFiles(self):
+		for root, dirs, files in os.walk(self.cacheDir):
+			for file in files:
+				if (file.endswith(".png")):
+					yield os.path.join(root, file)
+
+	def _cacheSize(self):
+		size = 0
+		for path in self._cacheFiles():
+			try:
+				size += os.path.getsize(path)
+			except OSError:
+				pass
+		return size
+
+	# returns the PNG data of a tile, or None if not available; offline:
+	# never download it, even if the cache is not offline
+	def get(self, zoom, x, y, offline=False):
+
+		path = self._tilePath(zoom, x, y)
+
+		# cache
+		try:
+			f = open(path, "rb")
+			data = f.read()
+			f.close()
+			# mark as recently used
+			os.utime(path, None)
+			self.hits += 1
+			return data
+		except (IOError, OSError):
+			pass
+
+		# seed sources
+		for source in self.seedSources:
+			data = readSeedTile(source, zoom, x, y)
+			if (data != None):
+				self.seedHits += 1
+				self.put(zoom, x, y, data)
+				return data
+
+		if (self.offline or offline):
+			self.misses += 1
+			return None
+
+		# tile server
+		import urllib2
+		try:
+			file = urllib2.urlopen(tileUrl%(zoom, x, y), timeout=tileTimeout)
+			data = file.read()
+			file.close()
+		except:
+			self.misses += 1
+			return None
+
+		self.downloads += 1
+		self.put(zoom, x, y, data)
+		return data
+
+	# saves a tile in the cache, then evicts old tiles if needed
+	def put(self, zoom, x, y, data):
+
+		path = self._tilePath(zoom, x, y)
+
+		try:
+			if (os.path.isdir(os.path.dirname(path)) == False):
+				os.makedirs(os.path.dirname(path))
+
+			# written aside and then renamed, other processes sharing the
+			# cache never read half-written tiles
+			fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+			os.write(fd, data)
+			os.close(fd)
+			os.rename(tempPath, path)
+		except (IOError, OSError):
+			print("Unable to save tile %i/%i/%i in cache \"%s\""%(zoom, x, y, self.cacheDir))
+			return
+
+		self.size += len(data)
+		if (self.size > self.maxSize):
+			self.evict()
+
+	# removes the least recently used tiles until the cache is at 90% of
+	# maxSize
+	def evict(self):
+
+		tiles = []
+		for path in self._cacheFiles():
+			try:
+				stats = os.stat(path)
+			except OSError:
+				continue
+			tiles.append((stats.st_mtime, stats.st_size, path))
+		tiles.sort()
+
+		size = sum([tile[1] for tile in tiles])
+		target = self.maxSize * 0.9
+
+		for (mtime, tileSize, path) in tiles:
+			if (size <= target):
+				break
+			try:
+				os.unlink(path)
+				size -= tileSize
+			except OSError:
+				pass
+
+		self.size = size
+
+	# copies every tile of a seed source (dir or MBTiles) into the cache;
+	# returns the number of tiles copied
+	def seed(self, source, minZoom=0, maxZoom=19):
+		count = 0
+		for (zoom, x, y, data) in iterSeedTiles(source):
+			if (zoom < minZoom or zoom > maxZoom):
+				continue
+			self.put(zoom, x, y, data)
+			count += 1
+		return count
+
+# ------- Seed Sources ----------------------------------------------------
+
+def isMBTiles(source):
+	return os.path.isfile(source)
+
+# MBTiles use TMS numbering, rows count from the bottom
+def _tmsRow(zoom, y):
+	return (2 ** zoom) - 1 - y
+
+def readSeedTile(source, zoom, x, y):
+	try:
+		if (isMBTiles(source)):
+			db = sqlite3.connect(source)
+			try:
+				row = db.execute(
+					"SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+					(zoom, x, _tmsRow(zoom, y))
+				).fetchone()
+			finally:
+				db.close()
+			if (row == None):
+				return None
+			return str(row[0])
+		else:
+			path = os.path.join(source, "%i"%zoom, "%i"%x, "%i.png"%y)
+			if (os.path.isfile(path) == False):
+				return None
+			f = open(path, "rb")
+			data = f.read()
+			f.close()
+			return data
+	except:
+		print("Unable to read tile %i/%i/%i from \"%s\": %s"%(zoom, x, y, source, sys.exc_info()[1]))
+		return None
+
+def iterSeedTiles(source):
+	if (isMBTiles(source)):
+		db = sqlite3.connect(source)
+		try:
+			for (zoom, x, row, data) in db.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"):
+				yield (zoom, x, _tmsRow(zoom, row), str(data))
+		finally:
+			db.close()
+	else:
+		for zoomDir in os.listdir(source):
+			if (zoomDir.isdigit() == False): continue
+			for xDir in os.listdir(os.path.join(source, zoomDir)):
+				if (xDir.isdigit() == False): continue
+				for file in os.listdir(os.path.join(source, zoomDir, xDir)):
+					(y, ext) = os.path.splitext(file)
+					if (ext != ".png" or y.isdigit() == False): continue
+					f = open(os.path.join(source, zoomDir, xDir, file), "rb")
+					data = f.read()
+					f.close()
+					yield (int(zoomDir), int(xDir), int(y), data)
+
+if __name__ == "__main__":
+
+	def usage():
+		print("")
+		print("PicciMario EXIF analyzer v. 0.1 - tile cache")
+		print("mario.piccinelli@gmail.com")
+		print("")
+		print("Usage:")
+		print("tilecache.py seed cachedir source [maxsizeMB]")
+		print("  copies all the tiles of source (a zoom/x/y.png dir or an MBTiles")
+		print("  file) into the cache dir used by exif2reporter.py --tile-cache")
+		print("tilecache.py info cachedir")
+		print("")
+
+	if (len(sys.argv) < 3 or sys.argv[1] not in ["seed", "info"]):
+		usage()
+		sys.exit(1)
+
+	maxSize = 200*1024*1024
+	if (sys.argv[1] == "seed"):
+		if (len(sys.argv) < 4):
+			usage()
+			sys.exit(1)
+		if (len(sys.argv) > 4):
+			maxSize = int(sys.argv[4]) * 1024 * 1024
+		cache = TileCache(sys.argv[2], maxSize=maxSize, offline=True)
+		start = time.time()
+		count = cache.seed(sys.argv[3])
+		print("Copied %i tiles in %.2fs, cache size %i kB"%(count, time.time() - start, cache.size/1024))
+	else:
+		cache = TileCache(sys.argv[2], offline=True)
+		print("Cache \"%s\": %i kB"%(cache.cacheDir, cache.size/1024))